@@ -16,7 +16,8 @@ def runner():
 
 @runner.command()
 @click.option('--symbol', prompt='Enter Symbol', help='Symbol (ie. BTC/USD)')
-def sim(symbol):
+@click.option('--candles', default=None, help='Local 1m candle CSV to initialize agents from (ie. ../telemetry/candles/cbpro-SOL-USD-60.csv), fetched from Coinbase if not given')
+def sim(symbol, candles):
     """
     Simulate various agents under a test environment.
     """
@@ -39,7 +40,7 @@ def sim(symbol):
     
     env.load_agents(agents)
 
-    env.initialize_agents(id='SOL-USD', qty_usd=1000000, qty_crypto=0)
+    env.initialize_agents(id='SOL-USD', qty_usd=1000000, qty_crypto=0, candles=candles)
 
     exec_start = time.time()
     env.run()
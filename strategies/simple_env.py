@@ -3,6 +3,7 @@ from clock import Clock
 from simple_agent import Agent, HODL_Agent, Test_Agent, SMA_5_20_Agent, SMA_1_5_Agent, DCA_Agent, RSI_Agent, RSI_MACD_Agent
 from simple_observer import Observer, CsvObserver, WebApiObserver, TelemetryObserver
 
+import os
 import cbpro
 import pandas as pd
 import datetime as dt
@@ -14,8 +15,14 @@ SECONDS_PER_LOOP = 60*300 # 60 seconds per minute, 300 minutes per API call
 SECONDS_PER_DAY = 86400
 SECONDS_PER_20DAYS = SECONDS_PER_DAY*20
 
+# Local candles must reach this close to both ends of the 20 day window,
+# otherwise the candles are fetched instead.
+CANDLE_COVERAGE_MARGIN = 60*60
+
 SIMULATED_SPREAD = 0.03
 
+CANDLE_COLUMNS = ['unix', 'low', 'high', 'open', 'close', 'volume']
+
 CBPRO_FEE_RATE = 0.005
 BINANCE_FEE_RATE = 0.001
 FEE_RATE = CBPRO_FEE_RATE
@@ -116,7 +123,26 @@ class SimulatedEnvironment(Environment):
             else:
                 print("ERROR: Cannot load object not of type Agent!")
 
-    def initialize_agents(self, id, qty_usd, qty_crypto):
+    def _read_local_candles(self, candles):
+        # Candles built by the telemetry trade flow (see telemetry/candle_builder.py),
+        # ie. ../telemetry/candles/cbpro-SOL-USD-60.csv, in the data_util.py layout.
+        # Relative paths are resolved against this directory, like CsvObserver.
+        # Returns None if the file does not cover the 20 day window.
+        filepath = os.path.join(os.path.dirname(__file__), candles)
+        if not os.path.exists(filepath):
+            print(f"WARNING: Local candles {filepath} not found")
+            return None
+        df = pd.read_csv(filepath, header=None, usecols=range(len(CANDLE_COLUMNS)), names=CANDLE_COLUMNS)
+        df = df[(df['unix'] >= self._start_time - SECONDS_PER_20DAYS) & (df['unix'] <= self._start_time)]
+        # Files written across telemetry restarts may repeat a candle.
+        df = df.drop_duplicates(subset='unix', keep='first').copy()
+        if (df.empty or df['unix'].min() > self._start_time - SECONDS_PER_20DAYS + CANDLE_COVERAGE_MARGIN
+                or df['unix'].max() < self._start_time - CANDLE_COVERAGE_MARGIN):
+            print(f"WARNING: Local candles {filepath} do not cover the 20 days before {dt.datetime.utcfromtimestamp(self._start_time)}")
+            return None
+        return df
+
+    def _fetch_candles(self, id):
         # To back-populate dataframe, use public API client to query historic candle data from
         # start time backwards to the limit time (set to 20 days).
         public_client = cbpro.PublicClient()
@@ -131,10 +157,18 @@ class SimulatedEnvironment(Environment):
             loop_datetime -= SECONDS_PER_LOOP
             # Short delay to prevent API throttle
             time.sleep(0.2)
-        
+
         # Now that candles has all the data in the desired timeframe, convert the list to a
         # dataframe that agents can use.
-        df = pd.DataFrame(candles, columns=['unix', 'low', 'high', 'open', 'close', 'volume'])
+        return pd.DataFrame(candles, columns=CANDLE_COLUMNS)
+
+    def initialize_agents(self, id, qty_usd, qty_crypto, candles=None):
+        # Candles are read from a local 1m candle CSV when given, which takes
+        # moments rather than minutes of rate limited REST requests, and are
+        # fetched if it does not cover the window.
+        df = self._read_local_candles(candles) if candles else None
+        if df is None:
+            df = self._fetch_candles(id)
         # Sort dataframe by ascending (earlier timestamps appear first or top)
         df.sort_values(by=['unix'], inplace=True, ascending=True)
         
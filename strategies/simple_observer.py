@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from pymongo import MongoClient
+from pymongo import MongoClient, DESCENDING, ASCENDING
 import datetime as dt
 import pandas as pd
 import math
@@ -111,21 +111,37 @@ class TelemetryObserver(Observer):
     collection and wallet data from the Coinbase REST API. Telemetry data
     stored in the Mongo DB collection has second precision unlike the Web 
     API Observer.
+
+    Reads are served by the timestamp index created by the telemetry writer
+    and only project the bid/ask of the observed symbol, so each observation
+    is a single indexed query regardless of the collection size.
     """
-    def __init__(self, symbol=DEFAULT_SYMBOL, url='mongodb://localhost:27017/', db='sniper-db', collection='telemetry'):
+    def __init__(self, symbol=DEFAULT_SYMBOL, url='mongodb://localhost:27017/', db='sniper-db', collection='telemetry', exchange='cb'):
         super().__init__(symbol=symbol)
         
         self._mongo_client = MongoClient(url)
         self._db = self._mongo_client[db]
         self._collection = self._db[collection]
 
+        # Document paths of the observed fields, ie. 'cb.SOL.b'
+        self._exchange = exchange
+        self._bid_key = f"{exchange}.{symbol}.b"
+        self._ask_key = f"{exchange}.{symbol}.a"
+        self._projection = {'_id': 0, 't': 1, self._bid_key: 1, self._ask_key: 1}
+
         self._auth_client = cbpro.AuthenticatedClient(API_KEY, API_SECRET, API_PASS)
         self._qty_usd = None
         self._qty_crypto = None
 
+    def _get_bid_ask(self, document):
+        pair = document[self._exchange][self.symbol]
+        return (pair['b'], pair['a'])
+
     def observe(self):
         # Fetch ticker data from last entry stored in Mongo DB collection.
-        cursor = self._collection.find().sort("_id", -1).limit(1)
+        document = self._collection.find_one({self._bid_key: {'$exists': True}},
+                                             projection=self._projection,
+                                             sort=[('t', DESCENDING)])
         # Fetch wallet state on-demand via REST API.
         accounts = self._auth_client.get_accounts()
         for account in accounts:
@@ -134,16 +150,32 @@ class TelemetryObserver(Observer):
             elif account['currency'] == self.symbol:
                 self._qty_crypto = float(account['balance'])
 
-        dtf = cursor[0]['t']
+        dtf = document['t']
+        bid, ask = self._get_bid_ask(document)
         return pd.DataFrame({
             'unix': math.floor(dtf.timestamp()), 
-            'bid': cursor[0]['cb']['SOL']['b'], 
-            'ask': cursor[0]['cb']['SOL']['a'], 
+            'bid': bid, 
+            'ask': ask, 
             'qty_usd': self._qty_usd, 
             'qty_crypto': self._qty_crypto, 
-            'networth': self._qty_crypto*cursor[0]['cb']['SOL']['b'] + self._qty_usd
+            'networth': self._qty_crypto*bid + self._qty_usd
             }, columns=DF_COLUMNS, index=[0])
 
+    def observe_range(self, start, end):
+        """Return the recorded bid/ask between two UTC datetimes [start, end).
+
+        Wallet fields are not available for historic observations and are left
+        empty for the environment to fill in.
+        """
+        cursor = self._collection.find({'t': {'$gte': start, '$lt': end}, self._bid_key: {'$exists': True}},
+                                       projection=self._projection,
+                                       sort=[('t', ASCENDING)])
+        rows = []
+        for document in cursor:
+            bid, ask = self._get_bid_ask(document)
+            rows.append((math.floor(document['t'].timestamp()), bid, ask, None, None, None))
+        return pd.DataFrame(rows, columns=DF_COLUMNS)
+
 if __name__ == '__main__':
     print("Test CsvObserver:")
     csv_obs = CsvObserver(filepath='csv/Coinbase_SOLUSD_data_sorted.csv', offset_minutes=0, spread=0.03)
@@ -1,53 +1,508 @@
+import time
+import threading
+import itertools
+from collections import deque
 from abc import ABC, abstractmethod
 from decimal import Decimal
+import pandas
 
-BIN_DEPTH_MARKER = [0.01, 0.02, 0.03, 0.04, 0.05, 0.06, 0.07, 0.08, 0.09, 0.10]
+from book_events import (BookEvent, Subscription, EVENT_TOP_OF_BOOK, EVENT_SPREAD, EVENT_BIN_THRESHOLD)
+
+from depth_bins import (BinSet, DEFAULT_DEPTHS, bin_book)
+from latency import (BookLatency, LatencyLock)
+from book_stats import IntervalStats
+from book_features import MicrostructureFeatures
+from liquidity_index import LiquidityIndex
+from frame_recorder import FrameRecorder
+
+BIN_DEPTH_MARKER = DEFAULT_DEPTHS
+
+# The default bin set is always exported first, as 'bd'/'ad' in telemetry.
+DEFAULT_BIN_SET = BinSet(BIN_DEPTH_MARKER)
+
+# Levels further than this fraction from the mid are pruned, well outside the
+# bins and the liquidity index. Pruning runs in the worker once every
+# PRUNE_EVERY level changes and removes at most PRUNE_BATCH levels at a time,
+# continuing on the next update if more remain.
+DEFAULT_PRUNE_DISTANCE = 0.3
+PRUNE_EVERY = 1000
+PRUNE_BATCH = 500
+
+# Approximate memory per price level (Decimal price and size, dict and sorted
+# list entries) and per journal entry (sharing the level's Decimals).
+LEVEL_BYTES = 270
+JOURNAL_ENTRY_BYTES = 100
+
+# Seconds between checkpoints of the whole book in its frame recording.
+CHECKPOINT_INTERVAL = 30
+
+KEY_MEMORY_BID_LEVELS = 'bl'
+KEY_MEMORY_ASK_LEVELS = 'al'
+KEY_MEMORY_JOURNAL = 'jl'
+KEY_MEMORY_PRUNED = 'p'
+KEY_MEMORY_KB = 'kb'
 
 class L2OrderBook(ABC):
 
-    ASK_LABELS = ['A0', 'A1', 'A2', 'A3', 'A4', 'A5', 'A6', 'A7', 'A8', 'A9']
-    BID_LABELS = ['B9', 'B8', 'B7', 'B6', 'B5', 'B4', 'B3', 'B2', 'B1', 'B0']
+    ASK_LABELS = DEFAULT_BIN_SET.ask_labels
+    BID_LABELS = DEFAULT_BIN_SET.bid_labels
+
+    # Number of level changes retained for export_changes().
+    JOURNAL_SIZE = 100000
 
     def get_ask_bins(self, ask):
-        return [ask,
-                ask+(ask*Decimal(BIN_DEPTH_MARKER[0])),
-                ask+(ask*Decimal(BIN_DEPTH_MARKER[1])),
-                ask+(ask*Decimal(BIN_DEPTH_MARKER[2])),
-                ask+(ask*Decimal(BIN_DEPTH_MARKER[3])),
-                ask+(ask*Decimal(BIN_DEPTH_MARKER[4])),
-                ask+(ask*Decimal(BIN_DEPTH_MARKER[5])),
-                ask+(ask*Decimal(BIN_DEPTH_MARKER[6])),
-                ask+(ask*Decimal(BIN_DEPTH_MARKER[7])),
-                ask+(ask*Decimal(BIN_DEPTH_MARKER[8])),
-                ask+(ask*Decimal(BIN_DEPTH_MARKER[9]))]
+        return [ask] + [ask*m for m in DEFAULT_BIN_SET.ask_multipliers]
 
     def get_bid_bins(self, bid):
-        return [bid-(bid*Decimal(BIN_DEPTH_MARKER[9])),
-                bid-(bid*Decimal(BIN_DEPTH_MARKER[8])),
-                bid-(bid*Decimal(BIN_DEPTH_MARKER[7])),
-                bid-(bid*Decimal(BIN_DEPTH_MARKER[6])),
-                bid-(bid*Decimal(BIN_DEPTH_MARKER[5])),
-                bid-(bid*Decimal(BIN_DEPTH_MARKER[4])),
-                bid-(bid*Decimal(BIN_DEPTH_MARKER[3])),
-                bid-(bid*Decimal(BIN_DEPTH_MARKER[2])),
-                bid-(bid*Decimal(BIN_DEPTH_MARKER[1])),
-                bid-(bid*Decimal(BIN_DEPTH_MARKER[0])),
-                bid]
+        return [bid*m for m in reversed(DEFAULT_BIN_SET.bid_multipliers)] + [bid]
 
-    @abstractmethod
-    def create(self):
-        pass
+    def _init_book_state(self, log_to, bins=None, prune_distance=None, max_levels=None):
+        # Worker, lock and derived state shared by every book, called from the
+        # book's __init__ once _bids and _asks exist. Frames are recorded
+        # under log_to when given.
+        self._run_worker = False
+        self._lock = LatencyLock()
+        self._init_events()
+        self._init_latency()
+        self._init_journal()
+        self._init_bins(bins)
+        self._init_pruning(prune_distance, max_levels)
+        self._stats = IntervalStats(time.monotonic())
+        self._features = MicrostructureFeatures(time.monotonic())
+        self._liquidity = LiquidityIndex(self._bids, self._asks)
+        self._init_recorder(FrameRecorder(log_to, self.feed_name) if log_to else None)
+
+    def worker(self):
+        # Applies queued messages until destroy() clears _run_worker.
+        while self._run_worker == True:
+            message = self._queue.get()
+            self._process_queued(message)
+            self._maybe_checkpoint()
+            self._queue.task_done()
+
+    def _init_bins(self, bins=None):
+        # Extra bin sets configured by name, called from the book's __init__.
+        bins = bins or {}
+        self._bin_names = list(bins)
+        self._bin_sets = [DEFAULT_BIN_SET] + [BinSet.from_config(spec) for spec in bins.values()]
+
+    def get_ask(self):
+        return self._asks.peekitem(0)[0]
+
+    def get_bid(self):
+        return self._bids.peekitem(-1)[0]
+
+    def get_spread(self):
+        return self.get_ask() - self.get_bid()
+
+    def get_mid_market_price(self):
+        return (self.get_bid() + (self.get_spread()/2))
+
+    def get_update_time(self):
+        return self._update_time
+
+    def export_raw_snapshot(self):
+        df_asks = pandas.DataFrame(list(self._asks.items()), columns=['price', 'size'])
+        df_bids = pandas.DataFrame(list(self._bids.items()), columns=['price', 'size'])
+        return (df_asks, df_bids)
+
+    def export(self):
+        with self._lock:
+            return self.export_grouped_snapshot()
+
+    def export_grouped_snapshot(self):
+        """Group the book into the default and any configured bin sets.
+
+        Returns (asks, bids, ask, bid, bin_sets). asks and bids are the default
+        bins as {'size': {label: size}}, bin_sets maps each configured set's
+        name to its own (asks, bids). Callers hold the lock.
+        """
+        ask = self.get_ask()
+        bid = self.get_bid()
+        grouped = bin_book(self._bids, self._asks, bid, ask, self._bin_sets)
+        asks, bids = grouped[0]
+        return (asks, bids, ask, bid, dict(zip(self._bin_names, grouped[1:])))
+
+    def _set_level(self, is_bid, price, size, keep=False):
+        # Every incremental change to a price level goes through here, so
+        # anything tracked per change is maintained in one place. With keep,
+        # a level of size 0 keeps its price in the book (see _set_top).
+        levels = self._bids if is_bid else self._asks
+        old_size = levels.get(price, 0)
+        at_touch = bool(levels) and price == levels.peekitem(-1 if is_bid else 0)[0]
+        if size <= 0:
+            size = Decimal(0)
+            if keep:
+                levels[price] = size
+            else:
+                levels.pop(price, 0)
+        else:
+            levels[price] = size
+        self._stats.on_level(is_bid, old_size, size)
+        self._features.on_level(is_bid, at_touch, old_size, size)
+        self._liquidity.on_level(is_bid, price, old_size, size)
+        self._version += 1
+        self._journal.append((self._version, is_bid, price, size))
+        self._changes_since_prune += 1
+
+    def _set_top(self, is_bid, price, size):
+        # Top of book feeds hold a single level per side, replaced by each new
+        # best price. Feeds that give no size still set the price, at size 0,
+        # which is journaled like a removal since it holds no depth.
+        levels = self._bids if is_bid else self._asks
+        if len(levels) == 1 and levels.peekitem(0) == (price, size):
+            return
+        for old in [p for p in levels if p != price]:
+            self._set_level(is_bid, old, Decimal(0))
+        self._set_level(is_bid, price, size, keep=True)
+
+    def _init_journal(self):
+        # Change journal, called from the book's __init__.
+        self._version = 0
+        self._journal = deque(maxlen=self.JOURNAL_SIZE)
+        self._journal_floor = 0
+
+    def _after_snapshot(self):
+        # Called after a snapshot replaces the whole book. Changes from before
+        # the snapshot can no longer be replayed and the liquidity index is stale.
+        self._version += 1
+        self._journal.clear()
+        self._journal_floor = self._version
+        self._liquidity.invalidate()
+
+    def export_changes(self, since_version=None):
+        """Return the levels that changed after since_version.
+
+        Returns a dict with:
+          - 'version': current book version, pass it as since_version next time
+          - 'snapshot': True if 'bids'/'asks' hold the full book, which happens
+            when since_version is None or older than the journal retains
+          - 'bids', 'asks': lists of (price, size), size 0 meaning removed
+
+        Example:
+            changes = book.export_changes()
+            ...
+            changes = book.export_changes(changes['version'])
+        """
+        with self._lock:
+            oldest = self._journal[0][0] - 1 if self._journal else self._journal_floor
+            if since_version is None or since_version < oldest or since_version > self._version:
+                return {'version': self._version, 'snapshot': True,
+                        'bids': list(self._bids.items()), 'asks': list(self._asks.items())}
+
+            # Versions in the journal are consecutive, so skip straight to since_version.
+            bids = {}
+            asks = {}
+            for version, is_bid, price, size in itertools.islice(self._journal, since_version - oldest, None):
+                (bids if is_bid else asks)[price] = size
+            return {'version': self._version, 'snapshot': False,
+                    'bids': list(bids.items()), 'asks': list(asks.items())}
+
+    def cost_to_fill(self, side, notional):
+        """Return (size, average price, worst price) of a market 'buy' or 'sell' of notional quote currency."""
+        with self._lock:
+            return self._liquidity.cost_to_fill(side, notional)
+
+    def price_for_size(self, side, size):
+        """Return the worst price reached by a market 'buy' or 'sell' of size base currency."""
+        with self._lock:
+            return self._liquidity.price_for_size(side, size)
+
+    def depth_within(self, side, pct):
+        """Return the total 'bid' or 'ask' size within pct (ie. 0.01 for 1%) of the touch."""
+        with self._lock:
+            return self._liquidity.depth_within(side, pct)
+
+    def _init_recorder(self, recorder):
+        # Frame recording, called from the book's __init__. recorder may be None.
+        self._recorder = recorder
+        self._record_lock = threading.Lock()
+        self._next_checkpoint = time.monotonic() + CHECKPOINT_INTERVAL
+
+    def close_recorder(self):
+        """Write any pending frames and close the frame recording, once the book is destroyed."""
+        if self._recorder:
+            self._recorder.close()
+
+    def _enqueue(self, message):
+        # Stamp the receive time while latency is sampled, keyed by the
+        # message object, which stays alive until the worker dequeues it.
+        if self._latency is not None:
+            self._rx_stamps[id(message)] = time.time()
+        # Record and queue together, so that the queue always holds exactly
+        # the recorded messages the worker has yet to apply.
+        if self._recorder:
+            with self._record_lock:
+                self._recorder.record(message)
+                self._queue.put(message)
+        else:
+            self._queue.put(message)
+
+    def _init_latency(self):
+        # Latency sampling state, called from the book's __init__. The book's
+        # lock must be a LatencyLock.
+        self._latency = None
+        self._latency_requested = False
+        self._rx_stamps = {}
+
+    @property
+    def latency_sampling(self):
+        """True if latency sampling is on, or requested on."""
+        return self._latency_requested
+
+    def set_latency_sampling(self, enabled):
+        """Turn per message latency sampling on (with fresh histograms) or off.
+
+        Only records the request, which the worker applies before its next
+        message, so it takes no locks and is safe to call from a signal handler.
+        """
+        self._latency_requested = bool(enabled)
+
+    def _apply_latency_request(self):
+        # Called by the worker only, so sampling state changes between messages.
+        if self._latency_requested:
+            self._rx_stamps = {}
+            self._latency = BookLatency()
+        else:
+            self._latency = None
+        self._lock.latency = self._latency
+
+    def export_latency(self):
+        """Return the latency histograms and queue depth gauge (see latency.py), or None if not sampled.
+
+        Histograms are read without stopping the worker, so stages may
+        differ by the odd message.
+        """
+        latency = self._latency
+        return None if latency is None else latency.export()
+
+    def _event_time(self, message):
+        # Exchange event time of a message in unix seconds, or None.
+        # Overridden by books whose messages carry one.
+        return None
+
+    def _process_queued(self, message):
+        # Called by the worker for each dequeued message.
+        if self._latency_requested != (self._latency is not None):
+            self._apply_latency_request()
+        latency = self._latency
+        if latency is None:
+            self.process_message(message)
+            return
+        dequeued = time.time()
+        received = self._rx_stamps.pop(id(message), None)
+        self._lock.worker = threading.get_ident()
+        self.process_message(message)
+        latency.on_message(self._event_time(message), received, dequeued, time.time(), self._queue.qsize())
+
+    def _export_checkpoint(self):
+        # Called with the lock held. Subclasses add any sync state they need.
+        return {
+            'bids': [[str(price), str(size)] for price, size in self._bids.items()],
+            'asks': [[str(price), str(size)] for price, size in self._asks.items()],
+            'update_time': self._update_time,
+            # Replays must prune at the same messages as the live book.
+            'changes_since_prune': self._changes_since_prune,
+        }
+
+    def load_checkpoint(self, state):
+        """Replace the book with a recorded checkpoint (see book_replay.py)."""
+        with self._lock:
+            self._bids.clear()
+            self._asks.clear()
+            for price, size in state['bids']:
+                self._bids[Decimal(price)] = Decimal(size)
+            for price, size in state['asks']:
+                self._asks[Decimal(price)] = Decimal(size)
+            self._update_time = state['update_time']
+            self._after_snapshot()
+            # Missing from checkpoints recorded before it was added.
+            self._changes_since_prune = state.get('changes_since_prune', 0)
+
+    def _maybe_checkpoint(self):
+        # Called by the worker between messages.
+        if self._recorder and time.monotonic() >= self._next_checkpoint:
+            self._checkpoint()
+
+    def _checkpoint(self):
+        # The record lock holds off new messages so the pending list matches
+        # the recording exactly.
+        if not self._recorder:
+            return
+        self._next_checkpoint = time.monotonic() + CHECKPOINT_INTERVAL
+        with self._record_lock:
+            with self._lock:
+                state = self._export_checkpoint()
+            with self._queue.mutex:
+                pending = list(self._queue.queue)
+            self._recorder.checkpoint(state, pending)
+
+    def _init_events(self):
+        # Update notification and subscriber state, called from the book's __init__.
+        self._update_event = threading.Event()
+        self._subscriptions = ()
+        self._subscription_lock = threading.Lock()
+        self._pending_events = []
+        self._last_top = None
+        self._last_spread = None
+
+    def _init_pruning(self, prune_distance=DEFAULT_PRUNE_DISTANCE, max_levels=None):
+        # Pruning policy, called from the book's __init__. Either limit may be None.
+        self._prune_distance = None if prune_distance is None else Decimal(str(prune_distance))
+        self._max_levels = max_levels
+        self._changes_since_prune = 0
+        self._pruned = 0
+
+    def _prune(self):
+        # Drop levels beyond the prune distance from the mid, or beyond
+        # max_levels per side, starting with the furthest. Pruned levels are
+        # journaled and unindexed like any removal, but are not market activity
+        # so they are left out of the stats and features.
+        self._changes_since_prune = 0
+        mid = self.get_mid_market_price()
+        budget = PRUNE_BATCH
+        for is_bid, levels in ((True, self._bids), (False, self._asks)):
+            if self._prune_distance is not None:
+                bound = mid * (1 - self._prune_distance) if is_bid else mid * (1 + self._prune_distance)
+            while levels and budget > 0:
+                price, size = levels.peekitem(0 if is_bid else -1)
+                far = self._prune_distance is not None and (price < bound if is_bid else price > bound)
+                if not far and (self._max_levels is None or len(levels) <= self._max_levels):
+                    break
+                del levels[price]
+                self._liquidity.on_level(is_bid, price, size, Decimal(0))
+                self._version += 1
+                self._journal.append((self._version, is_bid, price, Decimal(0)))
+                self._pruned += 1
+                budget -= 1
+
+        if budget == 0:
+            # Out of budget, carry on from the next update.
+            self._changes_since_prune = PRUNE_EVERY
+
+    def memory_usage(self):
+        """Return the book's level and journal counts, total levels pruned and estimated size in KB."""
+        with self._lock:
+            bid_levels = len(self._bids)
+            ask_levels = len(self._asks)
+            journal = len(self._journal)
+            nbytes = (bid_levels + ask_levels) * LEVEL_BYTES + journal * JOURNAL_ENTRY_BYTES + self._liquidity.nbytes()
+            return {
+                KEY_MEMORY_BID_LEVELS: bid_levels,
+                KEY_MEMORY_ASK_LEVELS: ask_levels,
+                KEY_MEMORY_JOURNAL: journal,
+                KEY_MEMORY_PRUNED: self._pruned,
+                KEY_MEMORY_KB: nbytes // 1024,
+            }
+
+    def _after_update(self):
+        # Called with the lock held once a whole update message is applied.
+        if self._bids and self._asks:
+            if self._changes_since_prune >= PRUNE_EVERY and (self._prune_distance is not None or self._max_levels is not None):
+                self._prune()
+            now = time.monotonic()
+            self._stats.on_update(now, self.get_mid_market_price(), self.get_spread())
+            if self._subscriptions:
+                self._collect_events(now)
+
+    def _collect_events(self, now):
+        # Runs under the lock, so only compare state here. Delivery happens in
+        # _notify() once the lock is released.
+        bid, bid_size = self._bids.peekitem(-1)
+        ask, ask_size = self._asks.peekitem(0)
+        top = (bid, bid_size, ask, ask_size)
+        spread = ask - bid
+        top_changed = top != self._last_top
+        spread_changed = spread != self._last_spread
+        self._last_top = top
+        self._last_spread = spread
+
+        top_event = BookEvent(EVENT_TOP_OF_BOOK, self.product_id, now,
+                              {'bid': bid, 'bid_size': bid_size, 'ask': ask, 'ask_size': ask_size})
+        spread_event = BookEvent(EVENT_SPREAD, self.product_id, now, {'spread': spread, 'bid': bid, 'ask': ask})
+
+        depths = {}
+        for subscription in self._subscriptions:
+            if top_changed and subscription.wants(EVENT_TOP_OF_BOOK):
+                self._pending_events.append((subscription, top_event))
+            if spread_changed and subscription.wants(EVENT_SPREAD):
+                self._pending_events.append((subscription, spread_event))
+            for i, threshold in enumerate(subscription.thresholds):
+                key = (threshold.side, threshold.depth)
+                if key not in depths:
+                    depths[key] = self._liquidity.depth_within(threshold.side, threshold.depth)
+                above = depths[key] >= threshold.size
+                was_above = subscription._above[i]
+                subscription._above[i] = above
+                if was_above is not None and above != was_above:
+                    self._pending_events.append((subscription, BookEvent(EVENT_BIN_THRESHOLD, self.product_id, now,
+                        {'threshold': threshold, 'size': depths[key], 'above': above})))
+
+    def _notify(self):
+        # Called by the worker after each batch, with the lock released, so
+        # subscribers never hold up readers of the book.
+        self._update_event.set()
+        if self._pending_events:
+            events = self._pending_events
+            self._pending_events = []
+            for subscription, event in events:
+                subscription.deliver(event)
+
+    def subscribe(self, events=(EVENT_TOP_OF_BOOK,), callback=None, thresholds=(), maxsize=0):
+        """Subscribe to book events pushed by the worker after each applied batch.
+
+        events is any of 'top', 'spread' and 'bin'. thresholds is a list of
+        BinThreshold(side, depth, size); giving any implies 'bin'. If callback
+        is given it is called with each BookEvent on the worker thread and must
+        not block. Otherwise read events from the returned subscription's queue.
+
+        Example:
+            sub = book.subscribe(['top', 'spread'])
+            event = sub.queue.get()
+        """
+        events = set(events)
+        if thresholds:
+            events.add(EVENT_BIN_THRESHOLD)
+        subscription = Subscription(events, callback=callback, thresholds=thresholds, maxsize=maxsize)
+        # Copy on write, the worker iterates whatever tuple it last saw.
+        with self._subscription_lock:
+            self._subscriptions = self._subscriptions + (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._subscription_lock:
+            self._subscriptions = tuple(s for s in self._subscriptions if s is not subscription)
+
+    def export_interval_stats(self):
+        """Return the stats accumulated since the previous call and reset them."""
+        with self._lock:
+            return self._stats.export(time.monotonic())
+
+    def export_features(self):
+        """Return microstructure features for the interval since the previous call."""
+        with self._lock:
+            return self._features.export(time.monotonic(), self._bids, self._asks)
+
+    def wait_for_update(self, timeout=None):
+        """Block until the book applies an update or timeout (seconds) expires.
+
+        Returns True if the book was updated since the previous call. Intended
+        for a single consumer, the update flag is cleared on return.
+        """
+        updated = self._update_event.wait(timeout)
+        self._update_event.clear()
+        return updated
 
     @abstractmethod
-    def destroy(self):
+    def process_message(self, message):
         pass
 
     @abstractmethod
-    def get_update_time(self):
+    def create(self):
         pass
 
     @abstractmethod
-    def export(self):
+    def destroy(self):
         pass
 
     @abstractmethod
@@ -0,0 +1,89 @@
+import time
+import threading
+from abc import ABC, abstractmethod
+
+from trade_stats import TradeFlowStats
+from candle_builder import CandleBuilder
+
+"""
+Base Trade Flow: Common interface of the trade (matches) consumers.
+
+A trade flow subscribes to the public trades of one pair and keeps rolling
+window stats over them (see trade_stats.py), and optionally builds OHLCV
+candles from them (see candle_builder.py). Trades are cheap to apply, so
+they are applied straight from the websocket thread rather than queued.
+"""
+
+class TradeFlow(ABC):
+    # A flow that receives nothing for this long is reset (see check_uptime).
+    # Feeds without heartbeats can be this quiet on an illiquid pair, which
+    # then only costs a needless reconnect.
+    STALE_SECONDS = 60
+
+    def _init_stats(self, windows, candles):
+        self._lock = threading.Lock()
+        self._stats = TradeFlowStats(windows)
+        # Candles are written under the candles directory when given.
+        self._candles = CandleBuilder(candles, self.feed_name) if candles else None
+        self._update_time = None
+        # Monotonic time of the last message received, None until created.
+        self._received = None
+
+    def _on_receive(self):
+        # Called from the flow's on_message() for every message, trades or not.
+        self._received = time.monotonic()
+
+    def _on_trade(self, price, size, is_buy, update_time, trade_time):
+        # trade_time is the exchange trade time in unix seconds.
+        with self._lock:
+            self._stats.on_trade(time.monotonic(), price, size, is_buy)
+            if self._candles:
+                self._candles.on_trade(trade_time, price, size)
+            self._update_time = update_time
+
+    def export(self):
+        """Return the last price and the stats of every rolling window."""
+        with self._lock:
+            # Exports are periodic, so candles close even while no trades arrive.
+            if self._candles:
+                self._candles.close_until(time.time())
+            return self._stats.export(time.monotonic())
+
+    def _open_candles(self):
+        # Called from the flow's create(), candles are built while it is subscribed.
+        with self._lock:
+            if self._candles:
+                self._candles.open()
+
+    def _close_candles(self):
+        # Called from the flow's destroy(), once trades have stopped, so no
+        # other flow (ie. after a restart) appends to the same files meanwhile.
+        with self._lock:
+            if self._candles:
+                self._candles.close()
+
+    def get_update_time(self):
+        return self._update_time
+
+    def check_uptime(self):
+        """Reset the flow if it received nothing for STALE_SECONDS."""
+        if self._received is None:
+            return
+        quiet = time.monotonic() - self._received
+        if quiet > self.STALE_SECONDS:
+            print(f"WARNING: {self.feed_name} trade flow received nothing for {quiet:.0f}s. Attempting reset.")
+            self.destroy()
+            self.create()
+
+    @property
+    @abstractmethod
+    def feed_name(self):
+        pass
+
+    @abstractmethod
+    def create(self):
+        pass
+
+    @abstractmethod
+    def destroy(self):
+        pass
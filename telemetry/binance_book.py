@@ -0,0 +1,30 @@
+import datetime as dt
+
+"""
+Binance Book: Behaviour shared by the Binance order books.
+
+Every Binance book follows a single symbol, and keeps the event time (ms) of
+the last message it applied in _update_time.
+"""
+
+class Bi_BookMixin():
+    """Binance product id and uptime check. Listed ahead of L2OrderBook in a book's bases."""
+    # A book whose last message is older than this is reset.
+    STALE_SECONDS = 10
+
+    @property
+    def product_id(self):
+        """Order Book only supports a single product currently."""
+        return self._symbol
+
+    def check_uptime(self, time_now):
+        if self._update_time is None:
+            # Nothing received yet, so nothing to compare against.
+            return
+        # Convert the stored update time to datetime format for comparison.
+        dt_update_time = dt.datetime.utcfromtimestamp(int(self._update_time)//1000)
+        dt_delta = time_now - dt_update_time
+        if dt_delta.total_seconds() > self.STALE_SECONDS:
+            print(f"WARNING: Binance {self._symbol} last updated: {dt_update_time} vs current time: {time_now} (delta: {dt_delta}). Attempting reset.")
+            self.destroy()
+            self.create()
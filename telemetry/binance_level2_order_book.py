@@ -1,68 +1,90 @@
 import time
-import datetime as dt
 import threading
 import queue
-import pandas
 from decimal import Decimal
 from sortedcontainers.sorteddict import SortedDict
 
 from binance import Client
 from binance.streams import ThreadedWebsocketManager
-from base_level2_order_book import L2OrderBook
+from base_level2_order_book import (L2OrderBook, DEFAULT_PRUNE_DISTANCE)
+from binance_book import Bi_BookMixin
 from auth_keys import (binance_api_secret, binance_api_key)
 
-class Bi_L2OrderBook(L2OrderBook):
-    def __init__(self, symbol='BNBBTC', tld='com', interval=100, log_to=None):
+class Bi_L2OrderBook(Bi_BookMixin, L2OrderBook):
+    def __init__(self, symbol='BNBBTC', tld='com', interval=100, log_to=None, bins=None, prune_distance=DEFAULT_PRUNE_DISTANCE, max_levels=None, offline=False):
         self._symbol = symbol
         self._tld = tld
         self._interval = interval
         self._queue = queue.Queue()
 
         self._snapshot_id = 0
+        self._prev_final_id = 0
         self._asks = SortedDict()
         self._bids = SortedDict()
         self._update_time = None
 
-        self._run_worker = False
-        self._lock = threading.Lock()
+        # Raw messages, and the REST snapshots they apply to, are recorded
+        # under log_to when given (see frame_recorder.py).
+        self._init_book_state(log_to, bins, prune_distance, max_levels)
 
-        self._twm = ThreadedWebsocketManager(binance_api_key, binance_api_secret, tld=self._tld)
-        self._twm.start()
+        # Offline books are only fed recorded messages through process_message().
+        if not offline:
+            self._twm = ThreadedWebsocketManager(binance_api_key, binance_api_secret, tld=self._tld)
+            self._twm.start()
 
     @property
-    def product_id(self):
-        """Order Book only supports a single product currently."""
-        return self._symbol
+    def feed_name(self):
+        """Name of the book's frame recording."""
+        return f"binance.{self._tld}-{self._symbol}"
 
     def on_message(self, message):
-        self._queue.put(message)
-
-    def worker(self):
-        prev_final_id = 0
-        while self._run_worker == True:
-            msg = self._queue.get()
-            event_type = msg['e']
-            if event_type == 'depthUpdate':
-                if msg['u'] <= self._snapshot_id:
-                    # Drop any event where 'u' (final update Id in event) is less than
-                    # the snapshot Id.
-                    print(f"Dropping old event {msg['u']} <= {self._snapshot_id}")
-                    self._queue.task_done()
-                    continue
-
-                if prev_final_id > 0 and msg['U'] != (prev_final_id+1):
-                    # Each new event's 'U' (first update Id in event) should be equal to
-                    # the previous event's 'u' + 1. If this is not the case, then we have
-                    # an event gap and should resync the order book by taking a new snapshot.
-                    print(f"Event gap detected! Expected: {prev_final_id+1} Actual: {msg['U']}")
-
-                prev_final_id = msg['u']
-                with self._lock:
-                    self.apply_update(msg)
-
-            elif event_type == 'exit':
-                print(f"Binance {self.product_id} worker received exit message!")
-            self._queue.task_done()
+        self._enqueue(message)
+
+    def _event_time(self, msg):
+        # 'E' is the event time in ms.
+        return msg['E'] / 1000 if 'E' in msg else None
+
+    def process_message(self, msg):
+        if 'lastUpdateId' in msg:
+            # REST depth snapshot. Only seen when replaying recorded frames,
+            # create() applies it directly.
+            with self._lock:
+                self.apply_snapshot(msg)
+            self._prev_final_id = 0
+            return
+
+        event_type = msg['e']
+        if event_type == 'depthUpdate':
+            if msg['u'] <= self._snapshot_id:
+                # Drop any event where 'u' (final update Id in event) is less than
+                # the snapshot Id.
+                print(f"Dropping old event {msg['u']} <= {self._snapshot_id}")
+                return
+
+            if self._prev_final_id > 0 and msg['U'] != (self._prev_final_id+1):
+                # Each new event's 'U' (first update Id in event) should be equal to
+                # the previous event's 'u' + 1. If this is not the case, then we have
+                # an event gap and should resync the order book by taking a new snapshot.
+                print(f"Event gap detected! Expected: {self._prev_final_id+1} Actual: {msg['U']}")
+
+            self._prev_final_id = msg['u']
+            with self._lock:
+                self.apply_update(msg)
+            self._notify()
+
+        elif event_type == 'exit':
+            print(f"Binance {self.product_id} worker received exit message!")
+
+    def _export_checkpoint(self):
+        state = super(Bi_L2OrderBook, self)._export_checkpoint()
+        state['snapshot_id'] = self._snapshot_id
+        state['prev_final_id'] = self._prev_final_id
+        return state
+
+    def load_checkpoint(self, state):
+        super(Bi_L2OrderBook, self).load_checkpoint(state)
+        self._snapshot_id = state['snapshot_id']
+        self._prev_final_id = state['prev_final_id']
 
     def apply_snapshot(self, message):
         self._snapshot_id = message['lastUpdateId']
@@ -77,6 +99,7 @@ class Bi_L2OrderBook(L2OrderBook):
             price = Decimal(ask[0])
             size = Decimal(ask[1])
             self._asks[price] = size
+        self._after_snapshot()
 
     def apply_update(self, message):
         # Log the event time to keep track of possible de-sync.
@@ -86,64 +109,12 @@ class Bi_L2OrderBook(L2OrderBook):
             return
 
         for bids in message['b']:
-            price = Decimal(bids[0])
-            size = Decimal(bids[1])
-            if size <= 0:
-                self._bids.pop(price, default=0)
-                #print("Removed bid price level: ", price)
-            else:
-                self._bids[price] = size
-                #print(f"Bid price level {price} updated to size {size}")
+            self._set_level(True, Decimal(bids[0]), Decimal(bids[1]))
 
         for asks in message['a']:
-            price = Decimal(asks[0])
-            size = Decimal(asks[1])
-            if size <= 0:
-                self._asks.pop(price, default=0)
-                #print("Removed ask price level: ", price)
-            else:
-                self._asks[price] = size
-                #print(f"Ask price level {price} updated to size {size}")
-
-    def get_ask(self):
-        return self._asks.peekitem(0)[0]
-
-    def get_bid(self):
-        return self._bids.peekitem(-1)[0]
-
-    def get_spread(self):
-        return self.get_ask() - self.get_bid()
-
-    def get_mid_market_price(self):
-        return (self.get_bid() + (self.get_spread()/2))
-
-    def export_raw_snapshot(self):
-        df_asks = pandas.DataFrame(list(self._asks.items()), columns=['price', 'size'])
-        df_bids = pandas.DataFrame(list(self._bids.items()), columns=['price', 'size'])
-        return (df_asks, df_bids)
-
-    def export_grouped_snapshot(self):
-        # First get the raw ask and bid dataframes.
-        raw = self.export_raw_snapshot()
-
-        # We will group the raw dataframe into 10 bins. The bin edges must be calculated
-        # dynamically based on the ask and bid.
-        ask = self.get_ask()
-        bid = self.get_bid()
-        ask_bins = self.get_ask_bins(ask)
-        bid_bins = self.get_bid_bins(bid)
-        
-        # Now add new column 'price_bins' to the dataframe and sort data into bins.
-        raw[0]['price_bins'] = pandas.cut(raw[0]['price'], bins=ask_bins, labels=self.ASK_LABELS, include_lowest=True)
-        raw[1]['price_bins'] = pandas.cut(raw[1]['price'], bins=bid_bins, labels=self.BID_LABELS, include_lowest=True)
-
-        # Aggregate price and size into the 10 bins (dropping any that were out of range)
-        #grouped_asks = raw[0].groupby('price_bins', as_index=True).agg({'price': ['min', 'max'], 'size': 'sum'})
-        #grouped_bids = raw[1].groupby('price_bins', as_index=True).agg({'price': ['min', 'max'], 'size': 'sum'})
-        grouped_asks = raw[0].groupby('price_bins', as_index=True).agg({'size': 'sum'})
-        grouped_bids = raw[1].groupby('price_bins', as_index=True).agg({'size': 'sum'})
+            self._set_level(False, Decimal(asks[0]), Decimal(asks[1]))
 
-        return (grouped_asks, grouped_bids, ask, bid)
+        self._after_update()
 
     # Implement base_level2_order_book interface:
     def create(self):
@@ -168,7 +139,15 @@ class Bi_L2OrderBook(L2OrderBook):
         self._client.close_connection()
 
         # Apply the initial snapshot to populate asks/bids.
+        if self._recorder:
+            self._recorder.record(depth)
         self.apply_snapshot(depth)
+        # Diffs are validated against this snapshot alone, so reset the
+        # sequence before checkpointing the state replays start from.
+        self._prev_final_id = 0
+        # The snapshot is applied ahead of updates recorded before it, so
+        # checkpoint straight away for replays to start from.
+        self._checkpoint()
 
         # After the initial snapshot is done processing, turn on worker thread to begin
         # replaying buffered messages.
@@ -192,23 +171,6 @@ class Bi_L2OrderBook(L2OrderBook):
         # Clearing the queue not required because of update time check.
         #self._queue.clear()
 
-    def get_update_time(self):
-        return self._update_time
-
-    def export(self):
-        with self._lock:
-            return self.export_grouped_snapshot()
-
-    def check_uptime(self, time_now):
-        # Convert the stored update time to datetime format for comparison.
-        dt_update_time = dt.datetime.utcfromtimestamp(int(self._update_time)//1000)
-        dt_delta = time_now - dt_update_time
-        # If the last event update time is stale by more than 10 seconds, attempt restarting order book.
-        if dt_delta.total_seconds() > 10:
-            print(f"WARNING: Binance {self._symbol} last updated: {dt_update_time} vs current time: {time_now} (delta: {dt_delta}). Attempting reset.")
-            self.destroy()
-            self.create()
-
 if __name__ == '__main__':
     bn_order_book = Bi_L2OrderBook(symbol="SOLUSDT")
     bn_order_book.create()
@@ -0,0 +1,83 @@
+import time
+import threading
+import queue
+from decimal import Decimal
+from sortedcontainers.sorteddict import SortedDict
+
+from binance.streams import ThreadedWebsocketManager
+from base_level2_order_book import L2OrderBook
+from binance_book import Bi_BookMixin
+from auth_keys import (binance_api_secret, binance_api_key)
+
+class Bi_TickerBook(Bi_BookMixin, L2OrderBook):
+    """
+    Top of book only order book from the Binance individual symbol book
+    ticker stream, which pushes the best bid and ask (with sizes) on every
+    change. Each side holds just the best level; see Cb_TickerBook.
+
+    The stream has no heartbeat and is silent while the top does not change,
+    so a quiet pair is given longer than the other books before a reset.
+    """
+    STALE_SECONDS = 60
+
+    def __init__(self, symbol='BNBBTC', tld='com', log_to=None, bins=None, offline=False):
+        self._symbol = symbol
+        self._tld = tld
+        self._queue = queue.Queue()
+
+        self._asks = SortedDict()
+        self._bids = SortedDict()
+        self._update_time = None
+
+        self._init_book_state(log_to, bins)
+
+        # Offline books are only fed recorded messages through process_message().
+        if not offline:
+            self._twm = ThreadedWebsocketManager(binance_api_key, binance_api_secret, tld=self._tld)
+            self._twm.start()
+
+    @property
+    def feed_name(self):
+        """Name of the book's frame recording."""
+        return f"binance.{self._tld}-ticker-{self._symbol}"
+
+    def on_message(self, message):
+        # Book ticker messages carry no event time, so stamp the receive time
+        # (ms) for check_uptime(). It is recorded along with the message.
+        message['E'] = int(time.time()*1000)
+        self._enqueue(message)
+
+    def process_message(self, msg):
+        if 'u' in msg and 'b' in msg:
+            with self._lock:
+                self.apply_update(msg)
+            self._notify()
+        elif msg.get('e') == 'exit':
+            print(f"Binance {self.product_id} worker received exit message!")
+
+    def apply_update(self, message):
+        self._update_time = message['E']
+        if self.product_id != message['s']:
+            print(f"Unexpected Product Id. Received: {message['s']}, Expected: {self.product_id}")
+            return
+
+        self._set_top(True, Decimal(message['b']), Decimal(message['B']))
+        self._set_top(False, Decimal(message['a']), Decimal(message['A']))
+        self._after_update()
+
+    # Implement base_level2_order_book interface:
+    def create(self):
+        self._ts = self._twm.start_symbol_book_ticker_socket(callback=self.on_message, symbol=self._symbol)
+        self._run_worker = True
+        self._worker_thread = threading.Thread(target=self.worker, daemon=True)
+        self._worker_thread.start()
+
+    def destroy(self):
+        # Bring down the producer first.
+        self._twm.stop_socket(self._ts)
+        # Wait for any lingering messages to be processed. Ensures queue is drained before continuing.
+        self._queue.join()
+        # Mark the worker thread to stop running, then wake it with a poison pill.
+        self._run_worker = False
+        self._queue.put({"e":"exit"})
+        self._worker_thread.join()
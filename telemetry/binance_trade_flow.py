@@ -0,0 +1,54 @@
+import time
+
+from binance.streams import ThreadedWebsocketManager
+from base_trade_flow import TradeFlow
+from auth_keys import (binance_api_secret, binance_api_key)
+
+class Bi_TradeFlow(TradeFlow):
+    """
+    Trade flow of one Binance symbol from the aggregate trade stream.
+
+    'm' is set when the buyer is the maker, so the taker sold.
+    """
+    def __init__(self, symbol='BNBBTC', tld='com', windows=None, candles=None):
+        self._symbol = symbol
+        self._tld = tld
+        self._init_stats(windows, candles)
+        self._ts = None
+        self._twm = ThreadedWebsocketManager(binance_api_key, binance_api_secret, tld=self._tld)
+        self._twm.start()
+
+    @property
+    def product_id(self):
+        return self._symbol
+
+    @property
+    def feed_name(self):
+        return f"binance.{self._tld}-{self._symbol}"
+
+    def on_message(self, msg):
+        self._on_receive()
+        if msg.get('e') == 'aggTrade':
+            # 'T' is the trade time in ms.
+            self._on_trade(float(msg['p']), float(msg['q']), not msg['m'], msg['E'], msg['T'] / 1000)
+
+    # Implement base_trade_flow interface:
+    def create(self):
+        self._open_candles()
+        self._on_receive()
+        self._ts = self._twm.start_aggtrade_socket(callback=self.on_message, symbol=self._symbol)
+
+    def destroy(self):
+        # Safe to call before create().
+        if self._ts:
+            self._twm.stop_socket(self._ts)
+            self._ts = None
+        self._close_candles()
+
+if __name__ == '__main__':
+    trade_flow = Bi_TradeFlow(symbol="SOLUSDT")
+    trade_flow.create()
+
+    while True:
+        time.sleep(1)
+        print(trade_flow.export())
@@ -0,0 +1,69 @@
+import queue
+from collections import namedtuple
+
+"""
+Book Events: Push notifications for order book subscribers.
+
+Rather than polling export(), a consumer subscribes to an order book and is
+notified by the book's worker thread as soon as an update batch is applied:
+  - 'top': best bid/ask price or size changed
+  - 'spread': the spread changed
+  - 'bin': depth within a distance of the touch crossed a size threshold
+
+Events are either passed to a callback, which runs on the worker thread and
+must return quickly, or put on a queue for the subscriber to consume.
+"""
+
+EVENT_TOP_OF_BOOK = 'top'
+EVENT_SPREAD = 'spread'
+EVENT_BIN_THRESHOLD = 'bin'
+
+EVENT_TYPES = (EVENT_TOP_OF_BOOK, EVENT_SPREAD, EVENT_BIN_THRESHOLD)
+
+# time is time.monotonic() when the batch was applied, data is a dict whose
+# contents depend on the event type.
+BookEvent = namedtuple('BookEvent', ['type', 'product_id', 'time', 'data'])
+
+# Fires when the total size of one side ('bid' or 'ask') within depth (a
+# fraction of the touch price, ie. 0.01 for 1%) crosses size in either direction.
+BinThreshold = namedtuple('BinThreshold', ['side', 'depth', 'size'])
+
+class Subscription():
+    """
+    A subscription to one order book. Created by L2OrderBook.subscribe().
+
+    Without a callback, events are delivered to self.queue. If the queue is
+    bounded and full, new events are dropped and counted in self.dropped so a
+    slow consumer cannot stall the book.
+    """
+    def __init__(self, events, callback=None, thresholds=(), maxsize=0):
+        for event in events:
+            if event not in EVENT_TYPES:
+                raise ValueError(f"Unknown book event: {event}")
+        for threshold in thresholds:
+            if threshold.side not in ('bid', 'ask'):
+                raise ValueError(f"Unknown threshold side: {threshold.side}")
+
+        self.events = frozenset(events)
+        self.callback = callback
+        self.thresholds = tuple(thresholds)
+        self.queue = None if callback else queue.Queue(maxsize)
+        self.dropped = 0
+        # Last observed side of each threshold (True if above), None until first seen.
+        self._above = [None] * len(self.thresholds)
+
+    def wants(self, event_type):
+        return event_type in self.events
+
+    def deliver(self, event):
+        if self.callback:
+            try:
+                self.callback(event)
+            except Exception as e:
+                # Never let a subscriber take down the book's worker thread.
+                print(f"WARNING: {event.product_id} subscriber callback failed: {e}")
+        else:
+            try:
+                self.queue.put_nowait(event)
+            except queue.Full:
+                self.dropped += 1
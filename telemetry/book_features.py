@@ -0,0 +1,84 @@
+"""
+Book Features: Order book microstructure features for telemetry records.
+
+Flow features are counted per level change as updates are applied, and
+state features read only the top levels at export, so neither ever walks
+the whole book.
+"""
+
+KEY_IMBALANCE = 'im'
+KEY_MICROPRICE = 'mp'
+KEY_BID_DEPLETION = 'bq'
+KEY_ASK_DEPLETION = 'aq'
+KEY_LEVELS_ADDED = 'ln'
+KEY_LEVELS_REMOVED = 'lx'
+KEY_LEVEL_CHANGES = 'lc'
+
+# Number of levels per side used for the imbalance.
+DEFAULT_FEATURE_LEVELS = 5
+
+class MicrostructureFeatures():
+    """
+    Microstructure Features, exported with each record:
+      - imbalance of the top N levels: (bid size - ask size) / (bid size + ask size)
+      - microprice: touch prices weighted by the opposite touch size
+      - queue depletion: size/sec taken from the best bid and ask queues
+      - churn: price levels added and removed, and level changes, per sec
+
+    Rates cover the interval since the previous export. Not thread safe;
+    callers hold the owning book's lock.
+    """
+    def __init__(self, now, levels=DEFAULT_FEATURE_LEVELS):
+        self._levels = levels
+        self._reset(now)
+
+    def _reset(self, now):
+        self._start = now
+        self._bid_depleted = 0.0
+        self._ask_depleted = 0.0
+        self._levels_added = 0
+        self._levels_removed = 0
+        self._level_changes = 0
+
+    def on_level(self, is_bid, at_touch, old_size, new_size):
+        self._level_changes += 1
+        if new_size and not old_size:
+            self._levels_added += 1
+        elif old_size and not new_size:
+            self._levels_removed += 1
+        if at_touch and new_size < old_size:
+            if is_bid:
+                self._bid_depleted += float(old_size - new_size)
+            else:
+                self._ask_depleted += float(old_size - new_size)
+
+    def export(self, now, bids, asks):
+        """Return the features for the interval since the last export and start a new interval."""
+        elapsed = now - self._start
+        rate = (lambda count: count / elapsed) if elapsed > 0 else (lambda count: None)
+
+        imbalance = None
+        microprice = None
+        # Top of book feeds may not give sizes, and a missing size on either
+        # side would skew both features.
+        if bids and asks and bids.peekitem(-1)[1] > 0 and asks.peekitem(0)[1] > 0:
+            levels = min(self._levels, len(bids), len(asks))
+            bid_size = float(sum(bids.peekitem(-1-i)[1] for i in range(levels)))
+            ask_size = float(sum(asks.peekitem(i)[1] for i in range(levels)))
+            imbalance = (bid_size - ask_size) / (bid_size + ask_size)
+
+            bid, bid_top = bids.peekitem(-1)
+            ask, ask_top = asks.peekitem(0)
+            microprice = float((bid*ask_top + ask*bid_top) / (bid_top + ask_top))
+
+        features = {
+            KEY_IMBALANCE: imbalance,
+            KEY_MICROPRICE: microprice,
+            KEY_BID_DEPLETION: rate(self._bid_depleted),
+            KEY_ASK_DEPLETION: rate(self._ask_depleted),
+            KEY_LEVELS_ADDED: rate(self._levels_added),
+            KEY_LEVELS_REMOVED: rate(self._levels_removed),
+            KEY_LEVEL_CHANGES: rate(self._level_changes),
+        }
+        self._reset(now)
+        return features
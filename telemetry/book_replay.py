@@ -0,0 +1,88 @@
+import time
+import datetime as dt
+import click
+import simplejson as json
+
+from telemetry_db import (DEFAULT_BOOK_CONFIG, read_book_config)
+from frame_recorder import (find_checkpoint, read_frames)
+from global_order_book import (BOOK_CLASSES, FRAME_LOG_DIR, export_record)
+
+"""
+Book Replay: Rebuild an order book exactly as it was at any instant.
+
+Books record their raw messages and a checkpoint of the whole book every 30s
+(see frame_recorder.py). To rebuild a book at time t, the nearest checkpoint
+at or before t is found through the checkpoint index, the book is loaded from
+it along with the messages that were still queued, and only the frames
+received up to t are replayed into it. At most one checkpoint interval of
+messages is ever replayed, however long the recording.
+"""
+
+def make_offline_book(entry):
+    """Construct the registry entry's book without connecting or recording."""
+    options = {**entry.get('options', {}), 'log_to': None, 'offline': True}
+    return BOOK_CLASSES[entry['book']](entry['symbol'], **options)
+
+def replay_book(book, at, root=FRAME_LOG_DIR):
+    """Rebuild an offline book as it was at a UTC datetime.
+
+    Returns the number of frames replayed.
+    """
+    checkpoint = find_checkpoint(root, book.feed_name, at)
+    if checkpoint is None:
+        raise ValueError(f"No checkpoint of {book.feed_name} at or before {at}")
+
+    replayed = 0
+    # Frames received at exactly t are included.
+    for received, message in read_frames(root, book.feed_name, end=at + dt.timedelta(microseconds=1), checkpoint=checkpoint):
+        if 'checkpoint' in message:
+            # Reload at every checkpoint. Besides the first, this also corrects
+            # for REST snapshots that were applied ahead of earlier messages.
+            book.load_checkpoint(message['checkpoint'])
+            for pending in message['pending']:
+                book.process_message(pending)
+        else:
+            book.process_message(message)
+        replayed += 1
+    return replayed
+
+def reconstruct_book(exchange, pair, at, config=DEFAULT_BOOK_CONFIG, root=FRAME_LOG_DIR):
+    """Return the book of one exchange/pair in the registry as it was at a UTC datetime.
+
+    Example:
+        book = reconstruct_book('cb', 'SOL', dt.datetime(2021, 12, 19, 14, 3, 27, 512000))
+        print(book.get_bid(), book.get_ask(), book.cost_to_fill('buy', 50000))
+    """
+    for entry in read_book_config(config):
+        if entry['exchange'] == exchange and entry['pair'] == pair:
+            book = make_offline_book(entry)
+            replay_book(book, at, root)
+            return book
+    raise ValueError(f"No {exchange} {pair} book in {config}")
+
+@click.command()
+@click.option('--book', required=True, help='Exchange and pair as <exchange>:<pair> (ie. cb:SOL)')
+@click.option('--at', required=True, help='UTC time to rebuild the book at (ie. 2021-12-19T14:03:27.512)')
+@click.option('--config', default=DEFAULT_BOOK_CONFIG, help='Order book registry config file')
+@click.option('--root', default=FRAME_LOG_DIR, help='Frame recording directory')
+@click.option('--levels', default=0, help='Print this many levels per side instead of the export record')
+def replay(book, at, config, root, levels):
+    """Rebuild an order book at a past instant from its frame recording."""
+    exchange, pair = book.split(':')
+    start = time.time()
+    l2_order_book = reconstruct_book(exchange, pair, dt.datetime.fromisoformat(at), config, root)
+    elapsed = time.time() - start
+
+    if levels:
+        changes = l2_order_book.export_changes()
+        for price, size in reversed(changes['asks'][:levels]):
+            print(f"ask {price:>16} {size:>16}")
+        for price, size in reversed(changes['bids'][-levels:]):
+            print(f"bid {price:>16} {size:>16}")
+    else:
+        record, _ = export_record(l2_order_book, stats=False)
+        print(json.dumps(record, indent=4))
+    print(f"Rebuilt {exchange} {pair} at {at} in {elapsed*1000:.1f} ms")
+
+if __name__ == '__main__':
+    replay()
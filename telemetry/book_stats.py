@@ -0,0 +1,102 @@
+"""
+Book Stats: Statistics accumulated by an order book between samples.
+
+A sampled snapshot only shows the book at one instant. Interval stats are
+updated on every applied message instead, so each telemetry record also
+describes everything that happened since the previous record.
+"""
+
+KEY_UPDATE_COUNT = 'n'
+KEY_DURATION = 'd'
+KEY_MID_MIN = 'mn'
+KEY_MID_MAX = 'mx'
+KEY_MID_TWAP = 'mt'
+KEY_SPREAD_TWAP = 'st'
+KEY_BID_ADDED = 'ba'
+KEY_BID_REMOVED = 'br'
+KEY_ASK_ADDED = 'aa'
+KEY_ASK_REMOVED = 'ar'
+
+class IntervalStats():
+    """
+    Interval Stats track, between two exports:
+      - number of applied updates
+      - min, max and time-weighted mid price
+      - time-weighted spread
+      - size added to and removed from each side of the book
+
+    Not thread safe; callers hold the owning book's lock.
+    """
+    def __init__(self, now):
+        self._mid = None
+        self._spread = None
+        self._reset(now)
+
+    def _reset(self, now):
+        self._start = now
+        self._last_time = now
+        self._mid_min = self._mid
+        self._mid_max = self._mid
+        self._mid_time_sum = 0.0
+        self._spread_time_sum = 0.0
+        self._weighted_time = 0.0
+        self._updates = 0
+        self._bid_added = 0.0
+        self._bid_removed = 0.0
+        self._ask_added = 0.0
+        self._ask_removed = 0.0
+
+    def _accumulate(self, now):
+        # Weight the previous mid/spread by how long they were in effect.
+        if self._mid is not None:
+            elapsed = now - self._last_time
+            self._mid_time_sum += self._mid * elapsed
+            self._spread_time_sum += self._spread * elapsed
+            self._weighted_time += elapsed
+        self._last_time = now
+
+    def on_level(self, is_bid, old_size, new_size):
+        delta = float(new_size - old_size)
+        if is_bid:
+            if delta > 0:
+                self._bid_added += delta
+            else:
+                self._bid_removed -= delta
+        else:
+            if delta > 0:
+                self._ask_added += delta
+            else:
+                self._ask_removed -= delta
+
+    def on_update(self, now, mid, spread):
+        self._accumulate(now)
+        self._mid = float(mid)
+        self._spread = float(spread)
+        self._mid_min = self._mid if self._mid_min is None else min(self._mid_min, self._mid)
+        self._mid_max = self._mid if self._mid_max is None else max(self._mid_max, self._mid)
+        self._updates += 1
+
+    def export(self, now):
+        """Return the stats since the last export and start a new interval."""
+        self._accumulate(now)
+        if self._weighted_time > 0:
+            mid_twap = self._mid_time_sum / self._weighted_time
+            spread_twap = self._spread_time_sum / self._weighted_time
+        else:
+            mid_twap = self._mid
+            spread_twap = self._spread
+
+        stats = {
+            KEY_UPDATE_COUNT: self._updates,
+            KEY_DURATION: round(now - self._start, 6),
+            KEY_MID_MIN: self._mid_min,
+            KEY_MID_MAX: self._mid_max,
+            KEY_MID_TWAP: mid_twap,
+            KEY_SPREAD_TWAP: spread_twap,
+            KEY_BID_ADDED: self._bid_added,
+            KEY_BID_REMOVED: self._bid_removed,
+            KEY_ASK_ADDED: self._ask_added,
+            KEY_ASK_REMOVED: self._ask_removed,
+        }
+        self._reset(now)
+        return stats
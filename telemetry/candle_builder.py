@@ -0,0 +1,145 @@
+import os
+import math
+import datetime as dt
+
+"""
+Candle Builder: OHLCV candles built locally from a pair's trades.
+
+Candles are built in real time from the trade flow (see base_trade_flow.py),
+bucketed by exchange trade time, and appended to one CSV file per
+granularity as soon as they close. Rows use the column layout written by
+strategies/data_util.py and read by CsvObserver, without a header:
+
+    unix, low, high, open, close, volume, date, vol_fiat
+
+Like the REST candles, intervals without trades have no row. vol_fiat is the
+exact traded notional rather than volume * close.
+
+Example (1m candles of cbpro SOL-USD, ascending):
+    candles/cbpro-SOL-USD-60.csv
+"""
+
+DEFAULT_GRANULARITIES = (1, 60) # seconds
+
+# A candle is closed once the clock is this far past its end, so trades
+# delayed in transit still land in their own candle. Trades arriving for a
+# candle that was already written are counted, not recorded.
+CLOSE_DELAY = 2.0 # seconds
+
+# Bytes read from the end of a candle file to find its last row, far longer
+# than any row.
+LAST_ROW_BYTES = 4096
+
+def candle_path(root, name, granularity):
+    return os.path.join(root, f"{name}-{granularity}.csv")
+
+def _last_start(path):
+    # Start (unix) of the last complete row of a candle file, or None.
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - LAST_ROW_BYTES))
+        rows = f.read().split(b'\n')
+    # The last element is empty if the file ends with a complete row.
+    for row in reversed(rows[:-1]):
+        try:
+            return int(row.split(b',', 1)[0])
+        except ValueError:
+            continue
+    return None
+
+class _Candle():
+    __slots__ = ('start', 'low', 'high', 'open', 'close', 'volume', 'notional')
+
+    def __init__(self, start, price, size):
+        self.start = start
+        self.low = self.high = self.open = self.close = price
+        self.volume = size
+        self.notional = price * size
+
+    def add(self, price, size):
+        if price < self.low:
+            self.low = price
+        elif price > self.high:
+            self.high = price
+        self.close = price
+        self.volume += size
+        self.notional += price * size
+
+    def row(self):
+        date = dt.datetime.utcfromtimestamp(self.start)
+        return f"{self.start},{self.low!r},{self.high!r},{self.open!r},{self.close!r},{self.volume!r},{date},{self.notional!r}\n"
+
+class CandleBuilder():
+    """
+    The Candle Builder keeps the open candle of each granularity for one named
+    feed (ie. cbpro-SOL-USD) and appends closed candles under root.
+
+    Not thread safe; callers hold the owning trade flow's lock.
+    """
+    def __init__(self, root, name, granularities=DEFAULT_GRANULARITIES):
+        os.makedirs(root, exist_ok=True)
+        self._root = root
+        self._name = name
+        self._granularities = list(granularities)
+        self._open = {granularity: None for granularity in self._granularities}
+        # Start of the last candle written per granularity.
+        self._written = {granularity: None for granularity in self._granularities}
+        self._files = None
+        self.late = 0
+        self.open()
+
+    def open(self):
+        """Open the files for appending, again after close()."""
+        if self._files is None:
+            # Line buffered so every closed candle reaches the file straight away.
+            self._files = {granularity: open(candle_path(self._root, self._name, granularity), 'a', buffering=1)
+                           for granularity in self._granularities}
+            # Carry on after the last candle already in each file, ie. written
+            # before a restart, so it is never written twice.
+            for granularity in self._granularities:
+                last = _last_start(candle_path(self._root, self._name, granularity))
+                if last is not None and (self._written[granularity] is None or last > self._written[granularity]):
+                    self._written[granularity] = last
+
+    def _write(self, granularity):
+        candle = self._open[granularity]
+        self._files[granularity].write(candle.row())
+        self._written[granularity] = candle.start
+        self._open[granularity] = None
+
+    def on_trade(self, trade_time, price, size):
+        """Add a trade at trade_time (unix seconds, float) to every open candle."""
+        if self._files is None:
+            return
+        for granularity in self._granularities:
+            start = math.floor(trade_time / granularity) * granularity
+            candle = self._open[granularity]
+            written = self._written[granularity]
+            if candle is not None and start == candle.start:
+                candle.add(price, size)
+            elif (candle is not None and start < candle.start) or (written is not None and start <= written):
+                self.late += 1
+            else:
+                if candle is not None:
+                    self._write(granularity)
+                self._open[granularity] = _Candle(start, price, size)
+
+    def close_until(self, now):
+        """Write out every open candle that ended more than CLOSE_DELAY before now (unix seconds)."""
+        if self._files is None:
+            return
+        for granularity in self._granularities:
+            candle = self._open[granularity]
+            if candle is not None and candle.start + granularity + CLOSE_DELAY <= now:
+                self._write(granularity)
+
+    def close(self):
+        """Write out the open candles and close the files. Trades are ignored until open()."""
+        if self._files is None:
+            return
+        for granularity in self._granularities:
+            if self._open[granularity] is not None:
+                self._write(granularity)
+            self._files[granularity].close()
+        self._files = None
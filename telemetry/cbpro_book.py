@@ -0,0 +1,44 @@
+import datetime as dt
+
+from latency import iso_to_unix
+
+"""
+Cbpro Book: Behaviour shared by the Coinbase order books.
+
+Every Coinbase book is a cbpro.WebsocketClient subscribed to a single
+product, and keeps the ISO 'time' of the last message it applied in
+_update_time.
+"""
+
+class Cb_BookMixin():
+    """
+    Coinbase product id, event times and uptime check. Listed ahead of
+    cbpro.WebsocketClient and L2OrderBook in a book's bases.
+    """
+    # A book whose last message is older than this is reset.
+    STALE_SECONDS = 10
+
+    @property
+    def product_id(self):
+        """Order Book only supports a single product currently."""
+        return self.products[0]
+
+    def _event_time(self, message):
+        return iso_to_unix(message.get('time'))
+
+    def _last_message_time(self):
+        # ISO time of the last message showing the feed is alive, None before the first.
+        return self._update_time
+
+    def check_uptime(self, time_now):
+        last_message_time = self._last_message_time()
+        if last_message_time is None:
+            # Nothing received yet, so nothing to compare against.
+            return
+        # Cbpro times are ISO strings with a trailing Z, remove it for fromisoformat().
+        dt_update_time = dt.datetime.fromisoformat(last_message_time[:-1])
+        dt_delta = time_now - dt_update_time
+        if dt_delta.total_seconds() > self.STALE_SECONDS:
+            print(f"WARNING: Cbpro {self.product_id} last updated: {dt_update_time} vs current time: {time_now} (delta: {dt_delta}). Attempting reset.")
+            self.destroy()
+            self.create()
@@ -8,6 +8,8 @@ import matplotlib.pyplot as plt
 from auth_keys import (api_secret, api_key, api_pass)
 
 from cbpro_level2_order_book import Cb_L2OrderBook
+from cbpro_level3_order_book import Cb_L3OrderBook
+from book_events import EVENT_TOP_OF_BOOK
 
 @click.group()
 def cli():
@@ -709,48 +711,25 @@ def auth_get_fills(sandbox, product, order_id):
 def level3_order_book(product, expiry):
     """Logs real-time changes to the bid-ask spread to console.
 
-    The orderbook client will maintain a level3 order book and echo any changes
-    to the terminal until the expiry time (default 60 seconds).
+    The order book maintains a level3 order book from the full channel and
+    echoes any changes to the top of the book to the terminal until the
+    expiry time (default 60 seconds).
     """
 
-    class OrderBookConsole(cbpro.OrderBook):
-        def __init__(self, product_id=None):
-            super(OrderBookConsole, self).__init__(product_id)
-
-            # Latest values of bid-ask spread
-            self._bid = None
-            self._ask = None
-            self._bid_depth = None
-            self._ask_depth = None
-
-        def on_message(self, message):
-            super(OrderBookConsole, self).on_message(message)
-
-            # Calculate newest bid-ask spread
-            bid = self.get_bid()
-            bids = self.get_bids(bid)
-            bid_depth = sum([b['size'] for b in bids])
-            ask = self.get_ask()
-            asks = self.get_asks(ask)
-            ask_depth = sum([a['size'] for a in asks])
-
-            if self._bid == bid and self._ask == ask and self._bid_depth == bid_depth and self._ask_depth == ask_depth:
-                # If there are no changes to the bid-ask spread since the last update, no need to print
-                print("no change")
-            else:
-                # If there are differences, update the cache
-                self._bid = bid
-                self._ask = ask
-                self._bid_depth = bid_depth
-                self._ask_depth = ask_depth
-                print('{} {} bid: {:.3f} @ {:.2f}\task: {:.3f} @ {:.2f}'.format(
-                    dt.datetime.now(), self.product_id, bid_depth, bid, ask_depth, ask))
-
-    order_book_console = OrderBookConsole(product)
-    order_book_console.start()
+    def on_top_of_book(event):
+        top = event.data
+        print('{} {} bid: {:.3f} @ {:.2f}\task: {:.3f} @ {:.2f}'.format(
+            dt.datetime.now(), event.product_id, top['bid_size'], top['bid'], top['ask_size'], top['ask']))
+
+    # Top of book changes are pushed by the book's worker, so nothing is
+    # recomputed or printed for messages that leave the top unchanged.
+    l3_order_book = Cb_L3OrderBook(product_id=product)
+    l3_order_book.subscribe([EVENT_TOP_OF_BOOK], callback=on_top_of_book)
+    l3_order_book.create()
     time.sleep(expiry)
-    print(order_book_console.get_current_book())
-    order_book_console.close()
+    l3_order_book.destroy()
+    print(f"{l3_order_book.get_order_count()} orders")
+    print(l3_order_book.export())
 
 @cli.command()
 @click.option('--product', prompt='Enter Product Id', help='Product Id (ie. BTC-USD)')
@@ -766,12 +745,14 @@ def level2_order_book(product, expiry):
 
     # Export the final snapshot of the aggregated order book.
     book = l2_order_book.export()
-    print(book[0])
-    print(book[1])
+    grouped_asks = pandas.DataFrame(book[0])
+    grouped_bids = pandas.DataFrame(book[1])
+    print(grouped_asks)
+    print(grouped_bids)
     
     # Convert order book to json
-    asks_json = book[0].to_json()
-    bids_json = book[1].to_json()
+    asks_json = grouped_asks.to_json()
+    bids_json = grouped_bids.to_json()
     print(asks_json)
     print(bids_json)
 
@@ -784,10 +765,10 @@ def level2_order_book(product, expiry):
     print(bids_df)
 
     # Plot bar chart of grouped asks and bids.
-    book[1]['size'] = book[1]['size'].apply(pandas.to_numeric)
-    book[1].plot.bar(y='size') # x defaults to index
-    book[0]['size'] = book[0]['size'].apply(pandas.to_numeric)
-    book[0].plot.bar(y='size') # x defaults to index
+    grouped_bids['size'] = grouped_bids['size'].apply(pandas.to_numeric)
+    grouped_bids.plot.bar(y='size') # x defaults to index
+    grouped_asks['size'] = grouped_asks['size'].apply(pandas.to_numeric)
+    grouped_asks.plot.bar(y='size') # x defaults to index
     plt.show()
 
 @cli.command()
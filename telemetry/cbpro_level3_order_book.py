@@ -0,0 +1,277 @@
+import time
+import queue
+import threading
+from collections import OrderedDict
+import cbpro
+from decimal import Decimal
+from sortedcontainers.sorteddict import SortedDict
+
+from base_level2_order_book import L2OrderBook
+from cbpro_book import Cb_BookMixin
+
+# Queued by the snapshot fetch for the worker, never sent by Coinbase.
+RESYNC_MESSAGE = 'resync'
+
+# Message types that change resting orders. Others, ie. 'received', only
+# advance the sequence.
+BOOK_MESSAGES = ('open', 'done', 'change', 'match')
+
+# Delay before a failed snapshot fetch is retried.
+RESYNC_RETRY_DELAY = 1 # seconds
+
+class Cb_L3OrderBook(Cb_BookMixin, cbpro.WebsocketClient, L2OrderBook):
+    """
+    Level 3 (per order) order book built from the Coinbase 'full' channel.
+
+    Every resting order is kept in an order id map and in a FIFO queue at its
+    price level, and each level's aggregate size is maintained incrementally,
+    so a message costs O(1) regardless of how many orders rest at the price.
+    The aggregates form the L2 view shared with the L2 books, so export(),
+    bins, stats and liquidity queries work the same.
+
+    Pruning is off by default, pruned levels would leave their orders behind.
+
+    Snapshots are fetched from REST on their own thread, so the worker keeps
+    draining the queue meanwhile, buffering messages until the snapshot is
+    applied.
+    """
+    def __init__(self, product_id='BTC-USD', log_to=None, bins=None, prune_distance=None, max_levels=None, offline=False):
+        super(Cb_L3OrderBook, self).__init__(products=product_id, channels=['full'])
+        self._asks = SortedDict()
+        self._bids = SortedDict()
+        self._update_time = None
+        self._queue = queue.Queue()
+
+        # order id -> (is_bid, price), and per side price -> OrderedDict(order id -> size)
+        self._orders = {}
+        self._order_queues = {True: {}, False: {}}
+        self._sequence = None
+        self._offline = offline
+        # Resync state: messages buffered while a snapshot is fetched, and
+        # the session (create() count) fetched snapshots belong to.
+        self._resync_pending = False
+        self._resync_buffer = []
+        self._session = 0
+
+        self._init_book_state(log_to, bins, prune_distance, max_levels)
+
+    @property
+    def feed_name(self):
+        """Name of the book's frame recording."""
+        return f"cbpro-full-{self.product_id}"
+
+    def _clear(self):
+        self._asks.clear()
+        self._bids.clear()
+        self._orders.clear()
+        self._order_queues[True].clear()
+        self._order_queues[False].clear()
+
+    def _load_order(self, is_bid, price, size, order_id):
+        # Snapshot loading only, levels are totalled afterwards.
+        self._orders[order_id] = (is_bid, price)
+        self._order_queues[is_bid].setdefault(price, OrderedDict())[order_id] = size
+
+    def _total_levels(self):
+        for is_bid, levels in ((True, self._bids), (False, self._asks)):
+            for price, orders in self._order_queues[is_bid].items():
+                levels[price] = sum(orders.values())
+        self._after_snapshot()
+
+    def apply_snapshot(self, message):
+        self._clear()
+        for bid in message['bids']:
+            self._load_order(True, Decimal(bid[0]), Decimal(bid[1]), bid[2])
+        for ask in message['asks']:
+            self._load_order(False, Decimal(ask[0]), Decimal(ask[1]), ask[2])
+        self._total_levels()
+        self._sequence = message['sequence']
+
+    def _add_order(self, is_bid, price, size, order_id):
+        self._orders[order_id] = (is_bid, price)
+        self._order_queues[is_bid].setdefault(price, OrderedDict())[order_id] = size
+        levels = self._bids if is_bid else self._asks
+        self._set_level(is_bid, price, levels.get(price, 0) + size)
+
+    def _resize_order(self, order_id, size):
+        is_bid, price = self._orders[order_id]
+        orders = self._order_queues[is_bid][price]
+        delta = size - orders[order_id]
+        # Resizing keeps the order's place in the queue.
+        orders[order_id] = size
+        levels = self._bids if is_bid else self._asks
+        self._set_level(is_bid, price, levels.get(price, 0) + delta)
+
+    def _remove_order(self, order_id):
+        is_bid, price = self._orders.pop(order_id)
+        orders = self._order_queues[is_bid][price]
+        size = orders.pop(order_id)
+        levels = self._bids if is_bid else self._asks
+        if orders:
+            self._set_level(is_bid, price, levels.get(price, 0) - size)
+        else:
+            del self._order_queues[is_bid][price]
+            self._set_level(is_bid, price, Decimal(0))
+
+    def apply_update(self, message):
+        # Log the event time to keep track of possible de-sync in check_uptime().
+        self._update_time = message['time']
+        if self.product_id != message['product_id']:
+            print(f"Unexpected Product Id. Received: {message['product_id']}, Expected: {self.product_id}")
+            return
+
+        msg_type = message['type']
+        if msg_type == 'open':
+            # Only orders that rest on the book are opened. 'received' orders
+            # may fill immediately and never appear.
+            self._add_order(message['side'] == 'buy', Decimal(message['price']), Decimal(message['remaining_size']), message['order_id'])
+        elif msg_type == 'done':
+            if message['order_id'] in self._orders:
+                self._remove_order(message['order_id'])
+        elif msg_type == 'match':
+            if message['maker_order_id'] in self._orders:
+                order_id = message['maker_order_id']
+                is_bid, price = self._orders[order_id]
+                self._resize_order(order_id, self._order_queues[is_bid][price][order_id] - Decimal(message['size']))
+        elif msg_type == 'change':
+            if message['order_id'] in self._orders and 'new_size' in message:
+                self._resize_order(message['order_id'], Decimal(message['new_size']))
+
+        self._sequence = message['sequence']
+        if msg_type in BOOK_MESSAGES:
+            self._after_update()
+
+    def _resync(self):
+        # Start fetching a fresh level 3 snapshot. Returns False if none is
+        # coming, ie. offline.
+        if self._offline:
+            print(f"WARNING: Cbpro {self.product_id} sequence gap while offline, book may be inaccurate.")
+            return False
+        if not self._resync_pending:
+            self._resync_pending = True
+            threading.Thread(target=self._fetch_snapshot, args=(self._session,), daemon=True).start()
+        return True
+
+    def _fetch_snapshot(self, session):
+        # Runs on its own thread. The snapshot is handed to the worker through
+        # the queue, behind the messages received while it was fetched.
+        try:
+            snapshot = cbpro.PublicClient().get_product_order_book(self.product_id, level=3)
+        except Exception as e:
+            snapshot = {'message': str(e)}
+        if 'sequence' not in snapshot:
+            print(f"WARNING: Cbpro {self.product_id} snapshot failed: {snapshot.get('message')}")
+            time.sleep(RESYNC_RETRY_DELAY)
+            snapshot = None
+        self._queue.put({'type': RESYNC_MESSAGE, 'session': session, 'snapshot': snapshot})
+
+    def _apply_resync(self, snapshot):
+        # Messages buffered meanwhile are applied afterwards, skipping any the
+        # snapshot already includes.
+        buffered = self._resync_buffer
+        self._resync_buffer = []
+        self._resync_pending = False
+        if snapshot is None:
+            # Fetch again on the next message, the buffer is covered by it.
+            self._sequence = None
+            return
+        with self._lock:
+            self.apply_snapshot(snapshot)
+        self._notify()
+        for message in buffered:
+            self.process_message(message)
+        # The snapshot is applied ahead of messages recorded before it, so
+        # checkpoint straight away for replays to start from.
+        self._checkpoint()
+
+    def _checkpoint(self):
+        # Buffered messages are in neither the book nor the queue, so no
+        # checkpoint is taken while a resync is pending.
+        if not self._resync_pending:
+            super(Cb_L3OrderBook, self)._checkpoint()
+
+    def on_message(self, message):
+        self._enqueue(message)
+
+    def process_message(self, message):
+        msg_type = message['type']
+        if msg_type == 'exit':
+            print(f"Cbpro {self.product_id} worker received exit message!")
+            return
+        if msg_type == RESYNC_MESSAGE:
+            # Snapshots fetched before a destroy() are stale.
+            if message['session'] == self._session:
+                self._apply_resync(message['snapshot'])
+            return
+        if 'sequence' not in message:
+            # Subscriptions, heartbeats etc.
+            return
+
+        if self._resync_pending:
+            self._resync_buffer.append(message)
+            return
+        if self._sequence is None or message['sequence'] > self._sequence + 1:
+            if self._sequence is not None:
+                print(f"Sequence gap detected! Expected: {self._sequence+1} Actual: {message['sequence']}")
+            if self._resync():
+                self._resync_buffer.append(message)
+                return
+        if self._sequence is None or message['sequence'] <= self._sequence:
+            return
+
+        with self._lock:
+            self.apply_update(message)
+        self._notify()
+
+    def get_level_orders(self, side, price):
+        """Return [(order id, size)] resting at a price on 'bid' or 'ask', in queue order."""
+        with self._lock:
+            return list(self._order_queues[side == 'bid'].get(Decimal(price), {}).items())
+
+    def get_order_count(self):
+        with self._lock:
+            return len(self._orders)
+
+    def _export_checkpoint(self):
+        # Orders, in queue order, rather than levels.
+        return {
+            'orders': [[order_id, is_bid, str(price), str(size)]
+                       for is_bid in (True, False)
+                       for price, orders in self._order_queues[is_bid].items()
+                       for order_id, size in orders.items()],
+            'sequence': self._sequence,
+            'update_time': self._update_time,
+            'changes_since_prune': self._changes_since_prune,
+        }
+
+    def load_checkpoint(self, state):
+        with self._lock:
+            self._clear()
+            for order_id, is_bid, price, size in state['orders']:
+                self._load_order(is_bid, Decimal(price), Decimal(size), order_id)
+            self._total_levels()
+            self._sequence = state['sequence']
+            self._update_time = state['update_time']
+            self._changes_since_prune = state.get('changes_since_prune', 0)
+
+    # Implement base_level2_order_book interface:
+    def create(self):
+        # The first sequenced message triggers the initial snapshot.
+        self._sequence = None
+        self._session += 1
+        self._resync_pending = False
+        self._resync_buffer = []
+        super(Cb_L3OrderBook, self).start()
+        self._run_worker = True
+        self._worker_thread = threading.Thread(target=self.worker, daemon=True)
+        self._worker_thread.start()
+
+    def destroy(self):
+        # Bring down the producer first.
+        super(Cb_L3OrderBook, self).close()
+        # Wait for any lingering messages to be processed. Ensures queue is drained before continuing.
+        self._queue.join()
+        # Mark the worker thread to stop running, then wake it with a poison pill.
+        self._run_worker = False
+        self._queue.put({"type":"exit"})
+        self._worker_thread.join()
@@ -0,0 +1,86 @@
+import queue
+import threading
+import cbpro
+from decimal import Decimal
+from sortedcontainers.sorteddict import SortedDict
+
+from base_level2_order_book import L2OrderBook
+from cbpro_book import Cb_BookMixin
+
+class Cb_TickerBook(Cb_BookMixin, cbpro.WebsocketClient, L2OrderBook):
+    """
+    Top of book only order book from the Coinbase 'ticker' channel.
+
+    Each side holds just the best level, so the book costs next to nothing to
+    maintain and export, while keeping the L2OrderBook interface (export,
+    events, stats, recording) for consumers that only need the bid and ask.
+    Depth bins beyond the touch are always empty.
+
+    Ticker messages are sent for every trade, not every quote change, so the
+    top may lag quotes that move without trading. Best sizes are only sent by
+    newer versions of the feed and are 0 otherwise.
+
+    The ticker channel only sends on trades, so a quiet pair can go well
+    over STALE_SECONDS without a ticker. The heartbeat channel is followed as
+    well to tell a quiet pair from a stalled feed.
+    """
+    def __init__(self, product_id='BTC-USD', log_to=None, bins=None, offline=False):
+        super(Cb_TickerBook, self).__init__(products=product_id, channels=['ticker', 'heartbeat'])
+        self._asks = SortedDict()
+        self._bids = SortedDict()
+        self._update_time = None
+        self._heartbeat_time = None
+        self._queue = queue.Queue()
+
+        self._init_book_state(log_to, bins)
+
+    @property
+    def feed_name(self):
+        """Name of the book's frame recording."""
+        return f"cbpro-ticker-{self.product_id}"
+
+    def apply_update(self, message):
+        # Log the event time to keep track of possible de-sync in check_uptime().
+        self._update_time = message['time']
+        if self.product_id != message['product_id']:
+            print(f"Unexpected Product Id. Received: {message['product_id']}, Expected: {self.product_id}")
+            return
+
+        self._set_top(True, Decimal(message['best_bid']), Decimal(message.get('best_bid_size', 0)))
+        self._set_top(False, Decimal(message['best_ask']), Decimal(message.get('best_ask_size', 0)))
+        self._after_update()
+
+    def on_message(self, message):
+        self._enqueue(message)
+
+    def process_message(self, message):
+        msg_type = message['type']
+        if msg_type == 'ticker':
+            with self._lock:
+                self.apply_update(message)
+            self._notify()
+        elif msg_type == 'heartbeat':
+            self._heartbeat_time = message['time']
+        elif msg_type == 'exit':
+            print(f"Cbpro {self.product_id} worker received exit message!")
+
+    def _last_message_time(self):
+        # Either a ticker or a heartbeat shows the feed is alive.
+        return max((t for t in (self._update_time, self._heartbeat_time) if t), default=None)
+
+    # Implement base_level2_order_book interface:
+    def create(self):
+        super(Cb_TickerBook, self).start()
+        self._run_worker = True
+        self._worker_thread = threading.Thread(target=self.worker, daemon=True)
+        self._worker_thread.start()
+
+    def destroy(self):
+        # Bring down the producer first.
+        super(Cb_TickerBook, self).close()
+        # Wait for any lingering messages to be processed. Ensures queue is drained before continuing.
+        self._queue.join()
+        # Mark the worker thread to stop running, then wake it with a poison pill.
+        self._run_worker = False
+        self._queue.put({"type":"exit"})
+        self._worker_thread.join()
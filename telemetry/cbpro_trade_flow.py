@@ -0,0 +1,59 @@
+import time
+import datetime as dt
+import cbpro
+
+from base_trade_flow import TradeFlow
+
+class Cb_TradeFlow(cbpro.WebsocketClient, TradeFlow):
+    """
+    Trade flow of one Coinbase product from the 'matches' channel.
+
+    The side of a match is the maker's side, so a 'sell' match is a taker buy.
+    The 'last_match' sent on subscribing is the last trade before the feed
+    started, and only sets the last price. The heartbeat channel tells a
+    quiet pair from a stalled feed.
+    """
+    STALE_SECONDS = 10
+
+    def __init__(self, product_id='BTC-USD', windows=None, candles=None):
+        super(Cb_TradeFlow, self).__init__(products=product_id, channels=['matches', 'heartbeat'])
+        self._init_stats(windows, candles)
+
+    @property
+    def product_id(self):
+        return self.products[0]
+
+    @property
+    def feed_name(self):
+        return f"cbpro-{self.product_id}"
+
+    def on_message(self, message):
+        msg_type = message['type']
+        self._on_receive()
+        if msg_type == 'match':
+            # Cbpro times are ISO strings with a trailing Z, remove it for fromisoformat().
+            trade_time = dt.datetime.fromisoformat(message['time'][:-1]).replace(tzinfo=dt.timezone.utc).timestamp()
+            self._on_trade(float(message['price']), float(message['size']), message['side'] == 'sell', message['time'], trade_time)
+        elif msg_type == 'last_match':
+            with self._lock:
+                self._stats.on_last_price(float(message['price']))
+
+    # Implement base_trade_flow interface:
+    def create(self):
+        self._open_candles()
+        self._on_receive()
+        super(Cb_TradeFlow, self).start()
+
+    def destroy(self):
+        # Safe to call before create().
+        if self.thread:
+            super(Cb_TradeFlow, self).close()
+        self._close_candles()
+
+if __name__ == '__main__':
+    trade_flow = Cb_TradeFlow(product_id='SOL-USD')
+    trade_flow.create()
+
+    while True:
+        time.sleep(1)
+        print(trade_flow.export())
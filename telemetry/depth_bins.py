@@ -0,0 +1,108 @@
+import math
+from decimal import Decimal
+
+"""
+Depth Bins: Configurable depth bin sets for grouped order book exports.
+
+A bin set is a list of increasing depths (fractions of the touch price). Bin
+i on the ask side holds the size priced above depth i-1 and up to depth i
+from the best ask, and likewise below the best bid. Labels run A0..An-1 for
+asks and Bn-1..B0 for bids (deepest first), so the default 1%..10% set
+produces the same labels as always.
+
+Bin sets are configured per book with the 'bins' option in the registry
+config. Each set is a list of depths and segments:
+  - 0.0005: a single edge
+  - {"step": 0.0005, "to": 0.005}: edges every step after the previous edge, up to 'to'
+  - {"log": 8, "to": 0.1}: 8 log spaced edges after the previous edge, up to 'to'
+
+Example (0.05% steps within 0.5%, then 0.5% steps out to 5%):
+    "options": {"bins": {"fine": [{"step": 0.0005, "to": 0.005}, {"step": 0.005, "to": 0.05}]}}
+"""
+
+DEFAULT_DEPTHS = [0.01, 0.02, 0.03, 0.04, 0.05, 0.06, 0.07, 0.08, 0.09, 0.10]
+
+# Rounding applied to generated edges so that float steps land on clean depths.
+EDGE_PRECISION = 10
+
+def parse_depths(spec):
+    """Expand a bin set config into a list of increasing depths."""
+    depths = []
+    for item in spec:
+        last = depths[-1] if depths else 0.0
+        if isinstance(item, dict) and 'step' in item:
+            count = int(round((item['to'] - last) / item['step']))
+            depths.extend(round(last + item['step']*(i+1), EDGE_PRECISION) for i in range(count))
+        elif isinstance(item, dict) and 'log' in item:
+            if last <= 0:
+                raise ValueError("Log spaced depths must follow a positive edge")
+            ratio = math.log(item['to'] / last) / item['log']
+            depths.extend(round(last * math.exp(ratio*(i+1)), EDGE_PRECISION) for i in range(item['log']))
+        else:
+            depths.append(float(item))
+
+    if not depths or any(b <= a for a, b in zip([0.0] + depths, depths)):
+        raise ValueError(f"Bin depths must be positive and increasing: {depths}")
+    return depths
+
+class BinSet():
+    """A set of depth bins with edge multipliers precomputed as Decimals."""
+    def __init__(self, depths):
+        self.depths = list(depths)
+        # Decimal(depth) keeps the exact float value, as edges always have, so
+        # levels priced exactly on a round edge keep falling in the same bin.
+        self.ask_multipliers = [1 + Decimal(depth) for depth in self.depths]
+        self.bid_multipliers = [1 - Decimal(depth) for depth in self.depths]
+        self.ask_labels = [f"A{i}" for i in range(len(self.depths))]
+        self.bid_labels = [f"B{i}" for i in reversed(range(len(self.depths)))]
+
+    @classmethod
+    def from_config(cls, spec):
+        return cls(parse_depths(spec))
+
+def _bin_side(levels, touch, bin_sets, is_bid):
+    # Visit the levels once, from the touch outward to the widest edge. Each
+    # set's bin index only ever moves outward, so the pass is
+    # O(levels within range + bins).
+    edges = [[touch * m for m in (bin_set.bid_multipliers if is_bid else bin_set.ask_multipliers)] for bin_set in bin_sets]
+    sizes = [[Decimal(0)] * len(bin_set.depths) for bin_set in bin_sets]
+    cursors = [0] * len(bin_sets)
+
+    if is_bid:
+        prices = levels.irange(minimum=min(e[-1] for e in edges), reverse=True)
+    else:
+        prices = levels.irange(maximum=max(e[-1] for e in edges))
+
+    for price in prices:
+        size = levels[price]
+        for k, e in enumerate(edges):
+            i = cursors[k]
+            last = len(e) - 1
+            if is_bid:
+                # Bins are (edge, previous edge], the deepest also includes its edge.
+                while i <= last and (price < e[i] or (price == e[i] and i < last)):
+                    i += 1
+            else:
+                # Bins are (previous edge, edge], the first also includes the touch.
+                while i <= last and price > e[i]:
+                    i += 1
+            cursors[k] = i
+            if i <= last:
+                sizes[k][i] += size
+    return sizes
+
+def bin_book(bids, asks, bid, ask, bin_sets):
+    """Group both sides of a book into every bin set in one pass per side.
+
+    Returns a list with one (asks, bids) tuple per bin set, each side a dict
+    of {'size': {label: size}} with labels in schema order.
+    """
+    ask_sizes = _bin_side(asks, ask, bin_sets, False)
+    bid_sizes = _bin_side(bids, bid, bin_sets, True)
+    grouped = []
+    for bin_set, ask_size, bid_size in zip(bin_sets, ask_sizes, bid_sizes):
+        grouped.append((
+            {'size': dict(zip(bin_set.ask_labels, ask_size))},
+            {'size': dict(zip(bin_set.bid_labels, reversed(bid_size)))},
+        ))
+    return grouped
@@ -0,0 +1,325 @@
+import os
+import zlib
+import fcntl
+import glob
+import time
+import queue
+import struct
+import bisect
+import threading
+import datetime as dt
+import json
+
+"""
+Frame Recorder: Flight recorder of the raw messages received by an order book.
+
+Every websocket message (and REST snapshot) a book receives is recorded as a
+frame with its receive time, so any sample can later be reproduced from the
+exact input the book saw. The book's thread only enqueues the message; a
+background thread serializes frames into blocks, compresses each block with
+zlib and appends it to an hourly file:
+
+    header: magic 'FRMR', version
+    block:  compressed size, frame count, first and last receive time (ns), zlib data
+    frame:  receive time (ns since epoch), payload length, JSON payload
+
+A sidecar index file holds (first receive time, offset) per block, so readers
+can seek close to a point in time without decompressing the whole file.
+Each hourly file has a single writer: a recorder holds an exclusive lock on
+it while open, and drops (and counts) its frames for the hour if another
+recorder, ie. a book from before a restart, already has it.
+
+Books also record periodic checkpoints: a frame {"checkpoint": state,
+"pending": [messages]} holding the whole book and the messages received but
+not yet applied when it was taken. A checkpoint always starts a new block and
+is listed in a second sidecar index, so a book can be rebuilt at any instant
+from the nearest preceding checkpoint (see book_replay.py).
+
+Example:
+    for received, message in read_frames('frames', 'cbpro-SOL-USD', start, end):
+        ...
+"""
+
+FILE_MAGIC = b'FRMR'
+FILE_VERSION = 1
+FILE_EXTENSION = '.frames'
+INDEX_EXTENSION = '.idx'
+CHECKPOINT_EXTENSION = '.ckpt'
+
+FILE_HEADER = struct.Struct('<4sH')
+BLOCK_HEADER = struct.Struct('<IIqq')
+FRAME_HEADER = struct.Struct('<qI')
+INDEX_ENTRY = struct.Struct('<qq')
+
+# A block is written once it holds this many uncompressed bytes, or once its
+# first frame is FLUSH_INTERVAL seconds old, whichever comes first.
+BLOCK_SIZE = 256*1024
+FLUSH_INTERVAL = 1.0 # seconds
+
+# Frames waiting to be written. Beyond this, frames are dropped (and counted)
+# rather than letting a stalled disk grow memory without bound.
+MAX_PENDING = 100000
+
+COMPRESSION_LEVEL = 6
+
+_STOP = object()
+
+def to_ns(t):
+    """Convert a naive UTC datetime to integer nanoseconds since the epoch."""
+    return int(t.replace(tzinfo=dt.timezone.utc).timestamp()) * 1000000000 + t.microsecond * 1000
+
+def _hour(received_ns):
+    return dt.datetime.utcfromtimestamp(received_ns // 1000000000).replace(minute=0, second=0, microsecond=0)
+
+def frame_path(root, name, hour):
+    return os.path.join(root, f"{name}-{hour.strftime('%Y%m%d-%H')}{FILE_EXTENSION}")
+
+class FrameRecorder():
+    """
+    The Frame Recorder appends raw messages for one named feed (ie.
+    cbpro-SOL-USD) to rotating hourly files under root. record() is safe to
+    call from any thread and never blocks.
+    """
+    def __init__(self, root, name):
+        self._root = root
+        self._name = name
+        self._queue = queue.Queue(MAX_PENDING)
+        self._file = None
+        self._index = None
+        self._checkpoints = None
+        self._hour = None
+        # True while another recorder holds the current hour's file.
+        self._locked_out = False
+        self.dropped = 0
+        os.makedirs(root, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def record(self, message):
+        try:
+            self._queue.put_nowait((time.time_ns(), message, False))
+        except queue.Full:
+            self.dropped += 1
+
+    def checkpoint(self, state, pending):
+        """Record a checkpoint of the book state and the messages not yet applied to it."""
+        try:
+            self._queue.put_nowait((time.time_ns(), {'checkpoint': state, 'pending': pending}, True))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Write any pending frames and stop the background thread."""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _close_files(self):
+        if self._file:
+            self._file.close()
+            self._index.close()
+            self._checkpoints.close()
+            self._file = None
+
+    def _open(self, hour):
+        self._close_files()
+        self._hour = hour
+
+        path = frame_path(self._root, self._name, hour)
+        self._file = open(path, 'ab')
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print(f"WARNING: {path} is already being recorded, dropping {self._name} frames for this hour")
+            self._file.close()
+            self._file = None
+            self._locked_out = True
+            return
+        self._locked_out = False
+        if self._file.tell() == 0:
+            self._file.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION))
+        else:
+            # Drop any partial block left behind by a crash mid-write.
+            self._file.truncate(_complete_length(path))
+            self._file.seek(0, os.SEEK_END)
+        self._index = open(path + INDEX_EXTENSION, 'ab')
+        self._checkpoints = open(path + CHECKPOINT_EXTENSION, 'ab')
+
+    def _write_block(self, block, frames, first, last, checkpoint=False):
+        hour = _hour(first)
+        if hour != self._hour:
+            self._open(hour)
+        if self._locked_out:
+            self.dropped += frames
+            return
+
+        data = zlib.compress(bytes(block), COMPRESSION_LEVEL)
+        offset = self._file.tell()
+        self._file.write(BLOCK_HEADER.pack(len(data), frames, first, last))
+        self._file.write(data)
+        self._file.flush()
+        # Index only blocks that are fully written.
+        self._index.write(INDEX_ENTRY.pack(first, offset))
+        self._index.flush()
+        if checkpoint:
+            self._checkpoints.write(INDEX_ENTRY.pack(first, offset))
+            self._checkpoints.flush()
+
+    def _run(self):
+        block = bytearray()
+        frames = 0
+        first = last = None
+        checkpoint = False
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is not None and item is not _STOP:
+                received, message, is_checkpoint = item
+                payload = json.dumps(message, separators=(',', ':')).encode('utf-8')
+                # Never let a block span two hourly files, and start a new
+                # block for every checkpoint so it can be found by offset.
+                if frames and (is_checkpoint or _hour(received) != _hour(first)):
+                    self._write_block(block, frames, first, last, checkpoint)
+                    block = bytearray()
+                    frames = 0
+                if not frames:
+                    first = received
+                    checkpoint = is_checkpoint
+                    deadline = time.monotonic() + FLUSH_INTERVAL
+                block += FRAME_HEADER.pack(received, len(payload))
+                block += payload
+                frames += 1
+                last = received
+
+            if frames and (item is None or item is _STOP or len(block) >= BLOCK_SIZE or time.monotonic() >= deadline):
+                self._write_block(block, frames, first, last, checkpoint)
+                block = bytearray()
+                frames = 0
+                deadline = None
+
+            if item is _STOP:
+                self._close_files()
+                self._hour = None
+                return
+
+def _complete_length(path):
+    # Length of the file up to the end of its last complete block.
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        offset = FILE_HEADER.size
+        while offset + BLOCK_HEADER.size <= size:
+            f.seek(offset)
+            length = BLOCK_HEADER.unpack(f.read(BLOCK_HEADER.size))[0]
+            if offset + BLOCK_HEADER.size + length > size:
+                break
+            offset += BLOCK_HEADER.size + length
+    return min(offset, size)
+
+class FrameReader():
+    """Reads the frames of one recorded file, seeking with its index when present."""
+    def __init__(self, path):
+        self._path = path
+        self._file = open(path, 'rb')
+        magic, version = FILE_HEADER.unpack(self._file.read(FILE_HEADER.size))
+        if magic != FILE_MAGIC:
+            raise ValueError(f"{path} is not a frame file")
+        if version != FILE_VERSION:
+            raise ValueError(f"{path} has unsupported version {version}")
+
+        index = _read_index(path + INDEX_EXTENSION)
+        self._index_times = [first for first, _ in index]
+        self._index_offsets = [offset for _, offset in index]
+
+    def _seek_offset(self, start_ns):
+        # Start at the last indexed block beginning at or before start_ns.
+        i = bisect.bisect_right(self._index_times, start_ns) - 1
+        return self._index_offsets[i] if i >= 0 else FILE_HEADER.size
+
+    def frames(self, start_ns=None, end_ns=None, offset=None):
+        """Yield (receive time ns, message) for frames received in [start_ns, end_ns).
+
+        Reading starts from the block at offset if given.
+        """
+        if offset is None:
+            offset = FILE_HEADER.size if start_ns is None else self._seek_offset(start_ns)
+        self._file.seek(offset)
+        while True:
+            header = self._file.read(BLOCK_HEADER.size)
+            if len(header) < BLOCK_HEADER.size:
+                return
+            length, count, first, last = BLOCK_HEADER.unpack(header)
+            data = self._file.read(length)
+            if len(data) < length:
+                return
+            if end_ns is not None and first >= end_ns:
+                return
+            if start_ns is not None and last < start_ns:
+                continue
+
+            block = zlib.decompress(data)
+            position = 0
+            for _ in range(count):
+                received, size = FRAME_HEADER.unpack_from(block, position)
+                position += FRAME_HEADER.size
+                if (start_ns is None or received >= start_ns) and (end_ns is None or received < end_ns):
+                    yield received, json.loads(block[position:position+size])
+                position += size
+
+    def close(self):
+        self._file.close()
+
+def _read_index(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        data = f.read()
+    # Ignore a partial trailing entry.
+    data = data[:len(data) - len(data) % INDEX_ENTRY.size]
+    return list(INDEX_ENTRY.iter_unpack(data))
+
+def frame_files(root, name):
+    """Return [(hour, path)] of the recorded files for one feed, oldest first."""
+    prefix = os.path.join(root, name) + '-'
+    files = []
+    for path in glob.glob(f"{glob.escape(prefix)}*{FILE_EXTENSION}"):
+        files.append((dt.datetime.strptime(path[len(prefix):-len(FILE_EXTENSION)], '%Y%m%d-%H'), path))
+    return sorted(files)
+
+def find_checkpoint(root, name, at):
+    """Return (path, offset, receive time ns) of the last checkpoint at or before a UTC datetime, or None."""
+    at_ns = to_ns(at)
+    for hour, path in reversed(frame_files(root, name)):
+        if hour > at:
+            continue
+        checkpoints = _read_index(path + CHECKPOINT_EXTENSION)
+        i = bisect.bisect_right([received for received, _ in checkpoints], at_ns) - 1
+        if i >= 0:
+            return (path, checkpoints[i][1], checkpoints[i][0])
+    return None
+
+def read_frames(root, name, start=None, end=None, checkpoint=None):
+    """Yield (receive time ns, message) for one feed between two UTC datetimes [start, end).
+
+    Pass a checkpoint from find_checkpoint() instead of start to read from it.
+    """
+    start_ns = None if start is None else to_ns(start)
+    end_ns = None if end is None else to_ns(end)
+    first_hour = None if start is None else start.replace(minute=0, second=0, microsecond=0)
+    for hour, path in frame_files(root, name):
+        offset = None
+        if checkpoint is not None:
+            if path < checkpoint[0]:
+                continue
+            if path == checkpoint[0]:
+                offset = checkpoint[1]
+        if (first_hour is not None and hour < first_hour) or (end is not None and hour >= end):
+            continue
+        reader = FrameReader(path)
+        try:
+            yield from reader.frames(start_ns, end_ns, offset)
+        finally:
+            reader.close()
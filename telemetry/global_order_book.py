@@ -1,13 +1,36 @@
 import time
+import math
+import queue
+import signal
+import threading
 import datetime as dt
 import simplejson as json
 import uuid
+import click
 import pandas
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from pymongo import MongoClient
+from pymongo.errors import PyMongoError
 from auth_keys import (api_secret, api_key, api_pass)
 
+from telemetry_db import (DEFAULT_MONGO_URL, DEFAULT_DB, DEFAULT_COLLECTION, DEFAULT_BOOK_CONFIG,
+    create_telemetry_collection, read_book_config,
+    KEY_METADATA, KEY_VERSION, KEY_SESSION_ID, KEY_SAMPLE_MODE, KEY_META_EXCHANGE, KEY_META_PAIR, KEY_CAPTURE_SPREAD, KEY_TIMESTAMP, KEY_INTENDED_TIMESTAMP,
+    KEY_EXCHANGE_COINBASE, KEY_TRADING_PAIR_SOL_USD,
+    KEY_LAST_UPDATE_AT, KEY_BID, KEY_ASK, KEY_BID_DEPTH, KEY_ASK_DEPTH, KEY_EXPORT_TIME, KEY_INTERVAL_STATS, KEY_FEATURES, KEY_BIN_SETS, KEY_MEMORY, KEY_TRADE_FLOW)
+
+from base_level2_order_book import L2OrderBook
+from snapshot_log import SnapshotLogWriter
+from shared_book import SharedBookWriter
+from telemetry_server import (RecordCache, TelemetryServer, DEFAULT_HOST, DEFAULT_PORT)
 from binance_level2_order_book import Bi_L2OrderBook
 from cbpro_level2_order_book import Cb_L2OrderBook
+from cbpro_level3_order_book import Cb_L3OrderBook
+from binance_ticker_book import Bi_TickerBook
+from cbpro_ticker_book import Cb_TickerBook
+from binance_trade_flow import Bi_TradeFlow
+from cbpro_trade_flow import Cb_TradeFlow
 
 import matplotlib.pyplot as plt
 from matplotlib import animation
@@ -19,96 +42,513 @@ Global Order Book: Version History
 - Initial Version.
 - 10% depth. Binance order books are not accurate.
 
+1.1:
+- Order books are exported in parallel.
+- Per book export time in ms ('xt').
+- Spread of book capture times within the sample in ms ('cs').
+
+1.2:
+- Samples fire on absolute deadlines at a configurable rate (default 1Hz).
+- Intended capture time ('ti') alongside the actual capture time ('t').
+
+1.3:
+- Sampling mode in metadata ('m.md'): 'interval' or 'event'.
+- In event mode, each document holds a single book, recorded only when the
+  book changes materially. Its exchange and pair are in the metadata
+  ('m.e', 'm.p').
+
+1.4:
+- Per book stats accumulated on every update since the previous record
+  ('is'): update count, min/max/time-weighted mid, time-weighted spread and
+  size added/removed per side.
+
+1.5:
+- Per book microstructure features ('f'): top 5 level imbalance, microprice,
+  best bid/ask queue depletion rates and level churn rates.
+
+1.6:
+- Depth bins are computed in a single pass without pandas. Books may
+  configure extra bin sets (ie. 0.05% steps near the touch), recorded by name
+  under 'bs' with their own 'bd' and 'ad'.
+
+1.7:
+- Levels far from the mid are pruned so books stay bounded in memory.
+- Per book memory accounting ('mu'): level and journal counts, total levels
+  pruned and estimated size in KB.
+
+1.8:
+- Trade flow ('tf') for books with a 'trades' entry in the registry config:
+  last price and, per rolling window (1s, 10s, 1m), trade count, VWAP, taker
+  buy/sell volume and largest print.
+- Each book's latest record is also published to shared memory for local
+  readers (see shared_book.py), and with its recent records over local HTTP
+  when --serve-port is given (see telemetry_server.py).
+- Optional per message latency sampling through each book's pipeline (see
+  latency.py), dumped to the console on SIGUSR1 and toggled on SIGUSR2.
+
 """
 
-VERSION_STRING = '1.0'
+VERSION_STRING = '1.8'
+
+SAMPLE_MODE_INTERVAL = 'interval'
+SAMPLE_MODE_EVENT = 'event'
+
+DEFAULT_SAMPLE_RATE = 1.0 # Hz
+
+# Event mode defaults, overridable per book with a 'trigger' entry in the
+# registry config, ie. "trigger": {"deadband": 0.02, "min_interval": 0.25}
+DEFAULT_DEADBAND = 0.05 # Fractional change of any depth bin
+DEFAULT_MIN_INTERVAL = 0.1 # seconds
+DEFAULT_MAX_INTERVAL = 10.0 # seconds
+
+SNAPSHOT_LOG_DIR = 'snapshots'
+
+# Every book records the raw messages it receives here (see frame_recorder.py),
+# unless its registry options set "log_to" otherwise (null to disable).
+FRAME_LOG_DIR = 'frames'
+
+# Order book classes that may be referenced by name in the registry config.
+# Every class takes the exchange symbol (product id) as its first argument.
+# The ticker books hold only the top of book, for pairs that need no depth.
+BOOK_CLASSES = {
+    'Cb_L2OrderBook': Cb_L2OrderBook,
+    'Bi_L2OrderBook': Bi_L2OrderBook,
+    'Cb_L3OrderBook': Cb_L3OrderBook,
+    'Cb_TickerBook': Cb_TickerBook,
+    'Bi_TickerBook': Bi_TickerBook,
+}
+
+# Trade flows build 1s and 1m candles here (see candle_builder.py), unless
+# their registry 'trades' entry sets "candles" otherwise (null to disable).
+CANDLE_DIR = 'candles'
+
+# Trade flow classes that may be referenced by name in a registry entry's
+# 'trades', ie. "trades": {"flow": "Bi_TradeFlow", "tld": "us"}. Every class
+# takes the exchange symbol as its first argument, the other keys are passed
+# as constructor arguments.
+TRADE_FLOW_CLASSES = {
+    'Cb_TradeFlow': Cb_TradeFlow,
+    'Bi_TradeFlow': Bi_TradeFlow,
+}
+
+# Delay between subscribing each order book (layered startup).
+STARTUP_DELAY = 2
+
+# Upper bound on threads used to export order books in parallel.
+MAX_EXPORT_WORKERS = 16
+
+# Mongo is only written from a background thread, so sampling and the local
+# sinks never wait on it. Documents waiting beyond this are dropped (and
+# counted) while Mongo is down, and operations give up after MONGO_TIMEOUT_MS
+# so the backlog drains quickly once it is reachable again.
+MAX_PENDING_INSERTS = 10000
+MONGO_TIMEOUT_MS = 2000
+
+# Back-off of an event sampler after an exception, before it samples again.
+EVENT_SAMPLER_BACKOFF = 5 # seconds
+
+BookEntry = namedtuple('BookEntry', ['exchange', 'pair', 'book', 'trigger', 'trades'])
+
+class SampleScheduler():
+    """
+    The Sample Scheduler paces the sampling loop on absolute deadlines of a
+    monotonic clock (start + n * period), so time spent sampling never shifts
+    later samples and the loop does not drift.
+
+    When a sample overruns one or more deadlines, the scheduler fires once for
+    the most recent deadline and counts the skipped ones as missed rather than
+    firing them back to back.
+    """
+    def __init__(self, rate=DEFAULT_SAMPLE_RATE):
+        if rate <= 0:
+            raise ValueError(f"Sample rate must be positive: {rate}")
+        self._period = 1.0 / rate
+        # Pair the monotonic start time with wall clock time so deadlines can
+        # be reported as UTC timestamps.
+        self._start = time.monotonic()
+        self._start_utc = dt.datetime.utcnow()
+        self._tick = 0
+        self.missed = 0
+
+    @property
+    def period(self):
+        return self._period
+
+    def wait(self):
+        """Block until the next deadline and return its intended UTC time."""
+        tick = self._tick + 1
+        deadline = self._start + tick*self._period
+        now = time.monotonic()
+        if now < deadline:
+            time.sleep(deadline - now)
+        else:
+            latest = math.floor((now - self._start) / self._period)
+            self.missed += latest - tick
+            tick = latest
+        self._tick = tick
+        return self._start_utc + dt.timedelta(seconds=tick*self._period)
+
+class EventTrigger():
+    """
+    The Event Trigger decides when a book has changed enough to be recorded in
+    event sampling mode. A record is material when the best bid or ask moved,
+    or any depth bin changed by more than the deadband (as a fraction of its
+    last recorded size). Records are emitted no more often than min_interval,
+    and at least every max_interval as a heartbeat while the book is idle.
+    """
+    def __init__(self, deadband=DEFAULT_DEADBAND, min_interval=DEFAULT_MIN_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL):
+        self.deadband = deadband
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+    def _bins_moved(self, last, current):
+        for label, size in current['size'].items():
+            size = float(size)
+            last_size = float(last['size'].get(label, 0))
+            if abs(size - last_size) > self.deadband * abs(last_size):
+                return True
+        return False
+
+    def is_material(self, last, current):
+        if last is None:
+            return True
+        if current[KEY_BID] != last[KEY_BID] or current[KEY_ASK] != last[KEY_ASK]:
+            return True
+        return (self._bins_moved(last[KEY_BID_DEPTH], current[KEY_BID_DEPTH]) or
+                self._bins_moved(last[KEY_ASK_DEPTH], current[KEY_ASK_DEPTH]))
+
+class TelemetryWriter():
+    """
+    The Telemetry Writer turns sampled records into telemetry documents and
+    writes them to the snapshot logs and the telemetry collection. It is safe
+    to share between sampling threads.
+    """
+    def __init__(self, collection, session_id, mode, cache=None):
+        self._collection = collection
+        self._session_id = session_id
+        self._mode = mode
+        # Latest and recent records served by the telemetry server, if any.
+        self._cache = cache
+        # Binary snapshot logs and shared memory segments are created on first
+        # sample per exchange/pair.
+        self._snapshot_logs = {}
+        self._shared_books = {}
+        self._lock = threading.Lock()
+        self.samples = 0
+        self.dropped = 0
+        self._inserts = queue.Queue(MAX_PENDING_INSERTS)
+        self._close_deadline = None
+        self._insert_thread = threading.Thread(target=self._run_inserts, daemon=True)
+        self._insert_thread.start()
+
+    def _run_inserts(self):
+        while True:
+            try:
+                document = self._inserts.get(timeout=1)
+            except queue.Empty:
+                document = None
+            if self._close_deadline is not None and (document is None or time.monotonic() > self._close_deadline):
+                return
+            if document is None:
+                continue
+            try:
+                self._collection.insert_one(document)
+            except PyMongoError as e:
+                print(f"WARNING: Failed to insert sample at {document[KEY_TIMESTAMP]}: {e}")
+
+    def close(self):
+        """Stop inserting. Documents still queued after MONGO_TIMEOUT_MS are dropped."""
+        self._close_deadline = time.monotonic() + MONGO_TIMEOUT_MS / 1000
+        self._insert_thread.join()
+
+    def _get_snapshot_log(self, exchange, pair):
+        with self._lock:
+            key = (exchange, pair)
+            if key not in self._snapshot_logs:
+                self._snapshot_logs[key] = SnapshotLogWriter(SNAPSHOT_LOG_DIR, exchange, pair,
+                    bid_labels=L2OrderBook.BID_LABELS, ask_labels=L2OrderBook.ASK_LABELS)
+            return self._snapshot_logs[key]
+
+    def _get_shared_book(self, exchange, pair):
+        with self._lock:
+            key = (exchange, pair)
+            if key not in self._shared_books:
+                self._shared_books[key] = SharedBookWriter(exchange, pair)
+            return self._shared_books[key]
+
+    def write(self, data, fields=None, metadata=None):
+        # Convert the python dict into json string.
+        json_data = json.dumps(data)
+
+        # Now convert it back to a python dict for insertion into mongo-db.
+        # This extra step rids the dict of non-compatible types.
+        document = json.loads(json_data)
+
+        # Insert the document metadata:
+        document[KEY_METADATA] = {KEY_VERSION: VERSION_STRING, KEY_SESSION_ID: self._session_id, KEY_SAMPLE_MODE: self._mode}
+        if metadata:
+            document[KEY_METADATA].update(metadata)
 
-KEY_METADATA = 'm'
-KEY_VERSION = 'v'
-KEY_SESSION_ID = 's'
+        # Per sample measurements are kept out of the metadata, which must stay
+        # constant for a session so time-series buckets can be shared.
+        if fields:
+            document.update(fields)
 
-KEY_TIMESTAMP = 't'
+        # The timestamp is the last thing to be added so it more accurately
+        # reflects the log time.
+        timestamp = dt.datetime.utcnow()
+        document[KEY_TIMESTAMP] = timestamp
 
-KEY_EXCHANGE_COINBASE = 'cb'
-KEY_EXCHANGE_BINANCE = 'bi'
-KEY_EXCHANGE_BINANCEUS = 'bu'
+        # Publish and append each sample to its binary snapshot log before
+        # touching the database so local consumers keep receiving data if
+        # Mongo is down.
+        for exchange, pairs in data.items():
+            for pair in pairs:
+                record = {**document[exchange][pair], KEY_TIMESTAMP: timestamp.isoformat()}
+                self._get_shared_book(exchange, pair).publish(record)
+                if self._cache:
+                    self._cache.add(exchange, pair, record)
+                self._get_snapshot_log(exchange, pair).append(timestamp, document[exchange][pair])
+
+        # Insert into database, from the background thread. insert_one() adds
+        # an _id to the document, so the queued one is a copy.
+        try:
+            self._inserts.put_nowait(dict(document))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+        with self._lock:
+            self.samples += 1
+        return document
+
+def load_registry(path=DEFAULT_BOOK_CONFIG):
+    registry = []
+    for entry in read_book_config(path):
+        book_class = BOOK_CLASSES[entry['book']]
+        options = {'log_to': FRAME_LOG_DIR, **entry.get('options', {})}
+        book = book_class(entry['symbol'], **options)
+        trades = None
+        if 'trades' in entry:
+            trade_options = {'candles': CANDLE_DIR, **entry['trades']}
+            trades = TRADE_FLOW_CLASSES[trade_options.pop('flow')](entry['symbol'], **trade_options)
+        registry.append(BookEntry(entry['exchange'], entry['pair'], book, entry.get('trigger', {}), trades))
+    return registry
+
+def find_book(registry, exchange, pair):
+    for entry in registry:
+        if entry.exchange == exchange and entry.pair == pair:
+            return entry.book
+    return None
+
+def start_books(registry):
+    # NOTE: As of 12/18/21 Binance API truncates initial snapshot. Therefore,
+    # Binance order books are not 100% accurate, but will become more accurate
+    # over time.
+    for entry in registry:
+        print(f"Subscribing to {entry.exchange} {entry.book.product_id}...")
+        entry.book.create()
+        if entry.trades:
+            entry.trades.create()
+        time.sleep(STARTUP_DELAY)
+
+def stop_books(registry):
+    # Unsubscribe every book and close its frame recording, so a restart's new
+    # books are the only ones recording to the frame files.
+    for entry in registry:
+        try:
+            entry.book.destroy()
+        except Exception as e:
+            print(f"WARNING: Failed to stop {entry.exchange} {entry.pair} order book: {e}")
+        entry.book.close_recorder()
+
+def stop_trade_flows(registry):
+    # Unsubscribe every trade flow and close its candles, so a restart's new
+    # flows are the only ones appending to the candle files.
+    for entry in registry:
+        if entry.trades:
+            try:
+                entry.trades.destroy()
+            except Exception as e:
+                print(f"WARNING: Failed to stop {entry.exchange} {entry.pair} trade flow: {e}")
+
+def export_record(book, stats=True):
+    export_start = time.time()
+    depth = book.export()
+    # Books are locked for the whole export, so the book state exported is
+    # the state at the time export returns.
+    capture_time = time.time()
+
+    record = {}
+    record[KEY_LAST_UPDATE_AT] = book.get_update_time()
+    record[KEY_BID] = depth[3]
+    record[KEY_ASK] = depth[2]
+    record[KEY_BID_DEPTH] = depth[1]
+    record[KEY_ASK_DEPTH] = depth[0]
+    if depth[4]:
+        record[KEY_BIN_SETS] = {name: {KEY_BID_DEPTH: bids, KEY_ASK_DEPTH: asks} for name, (asks, bids) in depth[4].items()}
+    record[KEY_EXPORT_TIME] = round((capture_time - export_start)*1000, 3)
+    if stats:
+        record[KEY_INTERVAL_STATS] = book.export_interval_stats()
+        record[KEY_FEATURES] = book.export_features()
+        record[KEY_MEMORY] = book.memory_usage()
+    return (record, capture_time)
+
+def export_entry(entry, stats=True):
+    # The book's record, with the pair's trade flow alongside it.
+    record, capture_time = export_record(entry.book, stats)
+    if stats and entry.trades:
+        record[KEY_TRADE_FLOW] = entry.trades.export()
+    return (record, capture_time)
+
+def dump_latency(registry):
+    # Print every book's latency histograms, nested like the telemetry records.
+    latency = {}
+    for entry in registry:
+        latency.setdefault(entry.exchange, {})[entry.pair] = entry.book.export_latency()
+    print(f"\n[{dt.datetime.utcnow()}] Latency (ms):")
+    print(json.dumps(latency, indent=4))
+
+def toggle_latency(registry):
+    # Only requests the change, which each book's worker applies, so no book
+    # lock is taken on the main thread (that may already hold one).
+    enabled = not any(entry.book.latency_sampling for entry in registry)
+    for entry in registry:
+        entry.book.set_latency_sampling(enabled)
+    print(f"\n[{dt.datetime.utcnow()}] Latency sampling {'on' if enabled else 'off'}")
+
+def install_latency_signals(registry):
+    # Dump on SIGUSR1, ie. kill -USR1 <pid>, and toggle sampling on SIGUSR2.
+    # Handlers run on the main thread between its own work.
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: dump_latency(registry))
+        signal.signal(signal.SIGUSR2, lambda signum, frame: toggle_latency(registry))
+
+def sample(registry, executor):
+    # Export every book concurrently so the sample takes as long as the
+    # slowest book rather than the sum of all of them, and the books are
+    # captured as close together in time as possible.
+    results = executor.map(export_entry, registry)
+
+    # Nest each book's record under its exchange and pair keys,
+    # ie. data['cb']['SOL'] = {...}
+    data = {}
+    capture_times = []
+    for entry, (record, capture_time) in zip(registry, results):
+        data.setdefault(entry.exchange, {})[entry.pair] = record
+        capture_times.append(capture_time)
+
+    capture_spread = round((max(capture_times) - min(capture_times))*1000, 3)
+    return (data, capture_spread)
+
+def run_interval_sampling(registry, writer, rate):
+    # One export thread per book (capped) so every book is captured together.
+    # The pool is shut down when sampling ends, ie. before a restart.
+    with ThreadPoolExecutor(max_workers=min(len(registry), MAX_EXPORT_WORKERS)) as executor:
+        scheduler = SampleScheduler(rate)
+        while True:
+
+            intended_timestamp = scheduler.wait()
+
+            data, capture_spread = sample(registry, executor)
+
+            #bids_df = pandas.DataFrame.from_dict(data['cb']['SOL'][KEY_BID_DEPTH])
+            #asks_df = pandas.DataFrame.from_dict(data['cb']['SOL'][KEY_ASK_DEPTH])
+            #bids_df['size'] = bids_df['size'].apply(pandas.to_numeric)
+            #asks_df['size'] = asks_df['size'].apply(pandas.to_numeric)
+            #print(bids_df)
+            #print(asks_df)
+
+            document = writer.write(data, fields={KEY_CAPTURE_SPREAD: capture_spread,
+                                                  KEY_INTENDED_TIMESTAMP: intended_timestamp})
+
+            # Display sample count
+            print(f"Last Sample: {document['t']}, Total Samples: {writer.samples}, Missed: {scheduler.missed}", end='\r')
+
+            # Check each order book and trade flow uptime and attempt resync if needed.
+            for entry in registry:
+                entry.book.check_uptime(document[KEY_TIMESTAMP])
+                if entry.trades:
+                    entry.trades.check_uptime()
+
+def run_event_sampler(entry, writer):
+    trigger = EventTrigger(**entry.trigger)
+    metadata = {KEY_META_EXCHANGE: entry.exchange, KEY_META_PAIR: entry.pair}
+    last_record = None
+    last_emit = 0
+    while True:
+        try:
+            # Sleep until the book changes, or until a heartbeat record is due.
+            entry.book.wait_for_update(timeout=max(0, last_emit + trigger.max_interval - time.monotonic()))
+
+            # Rate limit exports. Updates arriving in the meantime are coalesced
+            # into the next export.
+            wait = last_emit + trigger.min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+
+            # Interval stats and features are only read (and reset) when a record
+            # is emitted, so they always cover the time since the previous emitted record.
+            record, _ = export_record(entry.book, stats=False)
+            now = time.monotonic()
+            if trigger.is_material(last_record, record) or now - last_emit >= trigger.max_interval:
+                record[KEY_INTERVAL_STATS] = entry.book.export_interval_stats()
+                record[KEY_FEATURES] = entry.book.export_features()
+                record[KEY_MEMORY] = entry.book.memory_usage()
+                if entry.trades:
+                    record[KEY_TRADE_FLOW] = entry.trades.export()
+                document = writer.write({entry.exchange: {entry.pair: record}}, metadata=metadata)
+                last_record = record
+                last_emit = now
+                entry.book.check_uptime(document[KEY_TIMESTAMP])
+                if entry.trades:
+                    entry.trades.check_uptime()
+        except Exception as e:
+            # Samplers run on daemon threads outside main()'s restart, so one
+            # must not die silently. Back off, then keep sampling.
+            print(f"[{dt.datetime.utcnow()}] WARNING: {entry.exchange} {entry.pair} sampler exception: {e}")
+            time.sleep(EVENT_SAMPLER_BACKOFF)
 
-# The base currency is used to identify the trading pair. The quote
-# currency can always be assumed to be USD or equivalent (ie. USDT)
-# if it is missing from the pair.
-KEY_TRADING_PAIR_BTC_USD = 'BTC'
-KEY_TRADING_PAIR_ETH_USD = 'ETH'
-KEY_TRADING_PAIR_SOL_USD = 'SOL'
-KEY_TRADING_PAIR_MATIC_USD = 'MATIC'
+def run_event_sampling(registry, writer):
+    # Each book is watched by its own thread and emits its own records.
+    for entry in registry:
+        threading.Thread(target=run_event_sampler, args=(entry, writer), daemon=True).start()
 
-KEY_LAST_UPDATE_AT = 'u'
-KEY_BID = 'b'
-KEY_ASK = 'a'
-KEY_BID_DEPTH = 'bd'
-KEY_ASK_DEPTH = 'ad'
+    while True:
+        time.sleep(1)
+        print(f"Total Samples: {writer.samples}", end='\r')
 
-def main():
+def main(config=DEFAULT_BOOK_CONFIG, rate=DEFAULT_SAMPLE_RATE, mode=SAMPLE_MODE_INTERVAL, cache=None, latency=False):
     print("Started global order book at (UTC): ", dt.datetime.utcnow())
 
     session_id = uuid.uuid4().hex[0:6]
     print("Session Id: ", session_id)
 
-    mongo_client = MongoClient('mongodb://localhost:27017/')
-    db = mongo_client['sniper-db']
-    collection = db.telemetry
-    
-    # Start Coinbase L2 order books.
-    Coinbase_BTC_USD = Cb_L2OrderBook(product_id='BTC-USD')
-    Coinbase_ETH_USD = Cb_L2OrderBook(product_id='ETH-USD')
-    Coinbase_SOL_USD = Cb_L2OrderBook(product_id='SOL-USD')
-    
-    # Layered startup
-    print("Subscribing to Coinbase BTC-USD...")
-    Coinbase_BTC_USD.create()
-    time.sleep(2)
-
-    print("Subscribing to Coinbase ETH-USD...")
-    Coinbase_ETH_USD.create()
-    time.sleep(2)
-
-    print("Subscribing to Coinbase SOL-USD...")
-    Coinbase_SOL_USD.create()
-    time.sleep(2)
-
-    # Start Binance L2 order books.
+    mongo_client = MongoClient(DEFAULT_MONGO_URL, serverSelectionTimeoutMS=MONGO_TIMEOUT_MS,
+                               connectTimeoutMS=MONGO_TIMEOUT_MS, socketTimeoutMS=MONGO_TIMEOUT_MS)
+    db = mongo_client[DEFAULT_DB]
+    try:
+        collection = create_telemetry_collection(db, DEFAULT_COLLECTION)
+    except PyMongoError as e:
+        # Keep sampling to the snapshot logs until Mongo comes back.
+        print(f"WARNING: Failed to provision telemetry collection: {e}")
+        collection = db[DEFAULT_COLLECTION]
+
+    writer = TelemetryWriter(collection, session_id, mode, cache)
+
+    # Start every order book in the registry.
     # Binance currently leads all crypto exchanges in volume, thus its order
     # book must be taken into account when making trades. Binance is currently
     # not available in the US however, so actual trades must be performed on
     # either Coinbase or Binance.US
-    # NOTE: As of 12/18/21 Binance API truncates initial snapshot. Therefore,
-    # these order books are not 100% accurate, but will become more accurate
-    # over time.
-    Binance_BTC_USDT = Bi_L2OrderBook(symbol='BTCUSDT')
-    Binance_ETH_USDT = Bi_L2OrderBook(symbol='ETHUSDT')
-    Binance_SOL_USDT = Bi_L2OrderBook(symbol='SOLUSDT')
-
-    # Layered startup
-    print("Subscribing to Binance BTCUSDT...")
-    Binance_BTC_USDT.create()
-    time.sleep(2)
-
-    print("Subscribing to Binance ETHUSDT...")
-    Binance_ETH_USDT.create()
-    time.sleep(2)
-
-    print("Subscribing to Binance SOLUSDT...")
-    Binance_SOL_USDT.create()
-    time.sleep(2)
-
-    # Start Binance.US order books.
     # NOTE: Binance.US has lower fees than Coinbase but has significantly lower
     # volume and a deficient API. Optimal strategy may be to perform trades on
     # Binance.US, while using Coinbase's API and order book as a real-time proxy.
-    BinanceUS_SOL_USD = Bi_L2OrderBook(symbol='SOLUSD', tld='us')
-    
-    print("Subscribing to Binance.US SOLUSD...")
-    BinanceUS_SOL_USD.create()
-    time.sleep(2)
+    registry = load_registry(config)
+    if latency:
+        for entry in registry:
+            entry.book.set_latency_sampling(True)
+    install_latency_signals(registry)
 
     # Setup data visualizations
     fig = plt.figure()
@@ -118,8 +558,8 @@ def main():
 
     def animate(i, xs, ys):
         # Sample price from order book
-        price = Coinbase_SOL_USD.get_mid_market_price()
-        
+        price = find_book(registry, KEY_EXCHANGE_COINBASE, KEY_TRADING_PAIR_SOL_USD).get_mid_market_price()
+
         # Add x and y to lists
         xs.append(dt.datetime.now().strftime('%H:%M:%S'))
         ys.append(price)
@@ -141,139 +581,50 @@ def main():
     #ani = animation.FuncAnimation(fig, animate, fargs=(xs, ys), interval=5000)
     #plt.show()
 
-    samples = 0
-    while True:
-
-        exec_time_start = time.time()
-
-        Coinbase_BTC_USD_depth = Coinbase_BTC_USD.export()
-        Coinbase_ETH_USD_depth = Coinbase_ETH_USD.export()
-        Coinbase_SOL_USD_depth = Coinbase_SOL_USD.export()
-        Binance_BTC_USDT_depth = Binance_BTC_USDT.export()
-        Binance_ETH_USDT_depth = Binance_ETH_USDT.export()
-        Binance_SOL_USDT_depth = Binance_SOL_USDT.export()
-        BinanceUS_SOL_USD_depth = BinanceUS_SOL_USD.export()
-
-        data = {}
-        
-        cb_data = {}
-        bi_data = {}
-        bu_data = {}
-
-        cb_btc_usd_data = {}
-        cb_btc_usd_data[KEY_LAST_UPDATE_AT] = Coinbase_BTC_USD.get_update_time()
-        cb_btc_usd_data[KEY_BID] = Coinbase_BTC_USD_depth[3]
-        cb_btc_usd_data[KEY_ASK] = Coinbase_BTC_USD_depth[2]
-        cb_btc_usd_data[KEY_BID_DEPTH] = Coinbase_BTC_USD_depth[1].to_dict()
-        cb_btc_usd_data[KEY_ASK_DEPTH] = Coinbase_BTC_USD_depth[0].to_dict()
-
-        cb_eth_usd_data = {}
-        cb_eth_usd_data[KEY_LAST_UPDATE_AT] = Coinbase_ETH_USD.get_update_time()
-        cb_eth_usd_data[KEY_BID] = Coinbase_ETH_USD_depth[3]
-        cb_eth_usd_data[KEY_ASK] = Coinbase_ETH_USD_depth[2]
-        cb_eth_usd_data[KEY_BID_DEPTH] = Coinbase_ETH_USD_depth[1].to_dict()
-        cb_eth_usd_data[KEY_ASK_DEPTH] = Coinbase_ETH_USD_depth[0].to_dict()
-
-        cb_sol_usd_data = {}
-        cb_sol_usd_data[KEY_LAST_UPDATE_AT] = Coinbase_SOL_USD.get_update_time()
-        cb_sol_usd_data[KEY_BID] = Coinbase_SOL_USD_depth[3]
-        cb_sol_usd_data[KEY_ASK] = Coinbase_SOL_USD_depth[2]
-        cb_sol_usd_data[KEY_BID_DEPTH] = Coinbase_SOL_USD_depth[1].to_dict()
-        cb_sol_usd_data[KEY_ASK_DEPTH] = Coinbase_SOL_USD_depth[0].to_dict()
-
-        bi_btc_usdt_data = {}
-        bi_btc_usdt_data[KEY_LAST_UPDATE_AT] = Binance_BTC_USDT.get_update_time()
-        bi_btc_usdt_data[KEY_BID] = Binance_BTC_USDT_depth[3]
-        bi_btc_usdt_data[KEY_ASK] = Binance_BTC_USDT_depth[2]
-        bi_btc_usdt_data[KEY_BID_DEPTH] = Binance_BTC_USDT_depth[1].to_dict()
-        bi_btc_usdt_data[KEY_ASK_DEPTH] = Binance_BTC_USDT_depth[0].to_dict()
-
-        bi_eth_usdt_data = {}
-        bi_eth_usdt_data[KEY_LAST_UPDATE_AT] = Binance_ETH_USDT.get_update_time()
-        bi_eth_usdt_data[KEY_BID] = Binance_ETH_USDT_depth[3]
-        bi_eth_usdt_data[KEY_ASK] = Binance_ETH_USDT_depth[2]
-        bi_eth_usdt_data[KEY_BID_DEPTH] = Binance_ETH_USDT_depth[1].to_dict()
-        bi_eth_usdt_data[KEY_ASK_DEPTH] = Binance_ETH_USDT_depth[0].to_dict()
-
-        bi_sol_usdt_data = {}
-        bi_sol_usdt_data[KEY_LAST_UPDATE_AT] = Binance_SOL_USDT.get_update_time()
-        bi_sol_usdt_data[KEY_BID] = Binance_SOL_USDT_depth[3]
-        bi_sol_usdt_data[KEY_ASK] = Binance_SOL_USDT_depth[2]
-        bi_sol_usdt_data[KEY_BID_DEPTH] = Binance_SOL_USDT_depth[1].to_dict()
-        bi_sol_usdt_data[KEY_ASK_DEPTH] = Binance_SOL_USDT_depth[0].to_dict()
-
-        bu_sol_usd_data = {}
-        bu_sol_usd_data[KEY_LAST_UPDATE_AT] = BinanceUS_SOL_USD.get_update_time()
-        bu_sol_usd_data[KEY_BID] = BinanceUS_SOL_USD_depth[3]
-        bu_sol_usd_data[KEY_ASK] = BinanceUS_SOL_USD_depth[2]
-        bu_sol_usd_data[KEY_BID_DEPTH] = BinanceUS_SOL_USD_depth[1].to_dict()
-        bu_sol_usd_data[KEY_ASK_DEPTH] = BinanceUS_SOL_USD_depth[0].to_dict()
-
-        cb_data[KEY_TRADING_PAIR_BTC_USD] = cb_btc_usd_data
-        cb_data[KEY_TRADING_PAIR_ETH_USD] = cb_eth_usd_data
-        cb_data[KEY_TRADING_PAIR_SOL_USD] = cb_sol_usd_data
-        bi_data[KEY_TRADING_PAIR_BTC_USD] = bi_btc_usdt_data
-        bi_data[KEY_TRADING_PAIR_ETH_USD] = bi_eth_usdt_data
-        bi_data[KEY_TRADING_PAIR_SOL_USD] = bi_sol_usdt_data
-        bu_data[KEY_TRADING_PAIR_SOL_USD] = bu_sol_usd_data
-
-        data[KEY_EXCHANGE_COINBASE] = cb_data
-        data[KEY_EXCHANGE_BINANCE] = bi_data
-        data[KEY_EXCHANGE_BINANCEUS] = bu_data
-
-        #bids_df = pandas.DataFrame.from_dict(cb_sol_usd_data[KEY_BID_DEPTH])
-        #asks_df = pandas.DataFrame.from_dict(cb_sol_usd_data[KEY_ASK_DEPTH])
-        #bids_df['size'] = bids_df['size'].apply(pandas.to_numeric)
-        #asks_df['size'] = asks_df['size'].apply(pandas.to_numeric)
-        #print(bids_df)
-        #print(asks_df)
-
-        # Convert the python dict into json string.
-        json_data = json.dumps(data)
-
-        # Now convert it back to a python dict for insertion into mongo-db.
-        # This extra step rids the dict of non-compatible types.
-        document = json.loads(json_data)
-
-        # Insert the document metadata:
-        metadata = {}
-        metadata[KEY_VERSION] = VERSION_STRING
-        metadata[KEY_SESSION_ID] = session_id
-        document[KEY_METADATA] = metadata
-
-        # The timestamp is the last thing to be added so it more accurately
-        # reflects the log time.
-        timestamp = dt.datetime.utcnow()
-        document[KEY_TIMESTAMP] = timestamp
-
-        # Insert into database
-        collection.insert_one(document)
-
-        # Increment sample count and display
-        samples += 1
-        print(f"Last Sample: {document['t']}, Total Samples: {samples}", end='\r')
-
-        # Check each order book uptime and attempt resync if needed.
-        Coinbase_BTC_USD.check_uptime(timestamp)
-        Coinbase_ETH_USD.check_uptime(timestamp)
-        Coinbase_SOL_USD.check_uptime(timestamp)
-        Binance_BTC_USDT.check_uptime(timestamp)
-        Binance_ETH_USDT.check_uptime(timestamp)
-        Binance_SOL_USDT.check_uptime(timestamp)
-        BinanceUS_SOL_USD.check_uptime(timestamp)
-
-        exec_time = time.time() - exec_time_start
-        if exec_time > 1:
-            print(f"WARNING: Last loop took over 1s to execute: {exec_time}")
-            time.sleep(0.1)
+    # Sampling only ends with an exception, which cli() restarts from a new
+    # registry, so this registry's books and trade flows are stopped first.
+    try:
+        start_books(registry)
+        if mode == SAMPLE_MODE_EVENT:
+            run_event_sampling(registry, writer)
+        else:
+            run_interval_sampling(registry, writer, rate)
+    finally:
+        stop_books(registry)
+        stop_trade_flows(registry)
+        writer.close()
+        mongo_client.close()
+
+@click.command()
+@click.option('--config', default=DEFAULT_BOOK_CONFIG, help='Order book registry config file (see books.json)')
+@click.option('--mode', default=SAMPLE_MODE_INTERVAL, type=click.Choice([SAMPLE_MODE_INTERVAL, SAMPLE_MODE_EVENT]),
+              help='Sample all books at a fixed rate, or each book when it changes materially')
+@click.option('--rate', default=DEFAULT_SAMPLE_RATE, type=click.FloatRange(min=0, min_open=True), help='Samples per second in interval mode (ie. 4 for 250ms, 10 for 100ms snapshots)')
+@click.option('--serve-host', default=DEFAULT_HOST, help='Address to serve latest and recent records on (0.0.0.0 for other hosts)')
+@click.option('--serve-port', default=0, help=f'Port to serve latest and recent records on (ie. {DEFAULT_PORT}, 0 to disable)')
+@click.option('--latency/--no-latency', default=False, help='Sample per message latency from startup (SIGUSR1 dumps, SIGUSR2 toggles)')
+def cli(config, mode, rate, serve_host, serve_port, latency):
+    """Sample every order book in the registry into the telemetry collection."""
+    # The server and its records outlive restarts of the sampling below.
+    cache = None
+    if serve_port:
+        try:
+            server = TelemetryServer(RecordCache(), serve_host, serve_port)
+        except OSError as e:
+            # ie. the port is taken. Sampling matters more than serving.
+            print(f"WARNING: Failed to serve telemetry on {serve_host}:{serve_port}: {e}")
         else:
-            time.sleep(1-exec_time)
+            server.start()
+            cache = server.cache
+            print(f"Serving telemetry on http://{serve_host}:{serve_port}")
 
-if __name__ == '__main__':
     while True:
         try:
-            main()
+            main(config, rate, mode, cache, latency)
         except Exception as e:
             print(f"[{dt.datetime.utcnow()}] Exception occured: {e}")
             print("Attempting restart...")
             continue
+
+if __name__ == '__main__':
+    cli()
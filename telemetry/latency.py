@@ -0,0 +1,184 @@
+import time
+import threading
+import datetime as dt
+
+"""
+Latency: Per message latency through an order book's ingestion pipeline.
+
+When sampling is on, every queued message is stamped as it is received
+(on_message), dequeued by the worker, and once it is applied, and the stamps
+are compared with the exchange's event time. Each stage is recorded in its
+own histogram, so a stale sample can be traced to where the time went:
+
+    ex:  exchange event time -> received (network, plus any clock skew)
+    q:   received -> dequeued (waiting in the book's queue)
+    lk:  waiting for the book's lock in the worker (readers holding it)
+    ap:  dequeued -> applied (includes lk)
+    e2e: exchange event time -> applied
+
+plus a gauge of the queue depth seen by the worker. Sampling is off by
+default and then costs a couple of attribute checks per message and lock
+acquire. Turning it on or off only sets a request, which the worker applies
+before its next message.
+
+Histograms are HDR style: values (microseconds) are counted in buckets 1us
+wide up to 32us, then 16 buckets per power of two, so any value is recorded
+in O(1) within ~6% and the memory is fixed however many are recorded.
+"""
+
+STAGE_EXCHANGE = 'ex'
+STAGE_QUEUE = 'q'
+STAGE_LOCK = 'lk'
+STAGE_APPLY = 'ap'
+STAGE_END_TO_END = 'e2e'
+STAGES = (STAGE_EXCHANGE, STAGE_QUEUE, STAGE_LOCK, STAGE_APPLY, STAGE_END_TO_END)
+
+KEY_COUNT = 'n'
+KEY_MEAN = 'avg'
+KEY_MAX = 'mx'
+KEY_NEGATIVE = 'neg'
+KEY_PERCENTILES = ((50, 'p50'), (90, 'p90'), (99, 'p99'), (99.9, 'p999'))
+KEY_QUEUE_DEPTH = 'qd'
+KEY_DEPTH_LAST = 'last'
+
+SUB_BITS = 4
+SUB_BUCKETS = 1 << SUB_BITS
+LINEAR_LIMIT = 2 * SUB_BUCKETS
+# Enough octaves for over a day in microseconds.
+OCTAVES = 32
+BUCKETS = LINEAR_LIMIT + OCTAVES * SUB_BUCKETS
+
+class LatencyHistogram():
+    """
+    Latency Histogram of values in microseconds. Negative values (an exchange
+    clock ahead of ours) are counted and recorded as 0.
+
+    Not thread safe; a histogram is only recorded to by its book's worker.
+    """
+    def __init__(self):
+        self._counts = [0] * BUCKETS
+        self._count = 0
+        self._total = 0
+        self._max = 0
+        self._negative = 0
+
+    def record(self, micros):
+        if micros < 0:
+            self._negative += 1
+            micros = 0
+        if micros < LINEAR_LIMIT:
+            index = micros
+        else:
+            shift = micros.bit_length() - (SUB_BITS + 1)
+            index = min(LINEAR_LIMIT + (shift - 1) * SUB_BUCKETS + (micros >> shift) - SUB_BUCKETS, BUCKETS - 1)
+        self._counts[index] += 1
+        self._count += 1
+        self._total += micros
+        if micros > self._max:
+            self._max = micros
+
+    def _bucket_high(self, index):
+        # Highest value counted in a bucket.
+        if index < LINEAR_LIMIT:
+            return index
+        shift = (index - LINEAR_LIMIT) // SUB_BUCKETS + 1
+        mantissa = (index - LINEAR_LIMIT) % SUB_BUCKETS + SUB_BUCKETS
+        return ((mantissa + 1) << shift) - 1
+
+    def percentile(self, pct):
+        """Return the value (microseconds) at or below which pct percent of values fall."""
+        if not self._count:
+            return None
+        target = self._count * pct / 100
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if count and seen >= target:
+                return min(self._bucket_high(index), self._max)
+        return self._max
+
+    def export(self):
+        """Return the count, mean, percentiles and max, in milliseconds."""
+        stats = {KEY_COUNT: self._count}
+        if self._count:
+            stats[KEY_MEAN] = round(self._total / self._count / 1000, 3)
+            for pct, key in KEY_PERCENTILES:
+                stats[key] = round(self.percentile(pct) / 1000, 3)
+            stats[KEY_MAX] = round(self._max / 1000, 3)
+        if self._negative:
+            stats[KEY_NEGATIVE] = self._negative
+        return stats
+
+class BookLatency():
+    """Latency histograms of each pipeline stage and the queue depth gauge of one book."""
+    def __init__(self):
+        self.stages = {stage: LatencyHistogram() for stage in STAGES}
+        self._depth_last = 0
+        self._depth_max = 0
+        self._depth_total = 0
+        self._depth_count = 0
+
+    def on_message(self, event_time, received, dequeued, applied, depth):
+        # Times are unix seconds, event_time and received may be None.
+        stages = self.stages
+        if received is not None:
+            stages[STAGE_QUEUE].record(int((dequeued - received) * 1000000))
+        stages[STAGE_APPLY].record(int((applied - dequeued) * 1000000))
+        if event_time is not None:
+            if received is not None:
+                stages[STAGE_EXCHANGE].record(int((received - event_time) * 1000000))
+            stages[STAGE_END_TO_END].record(int((applied - event_time) * 1000000))
+
+        self._depth_last = depth
+        self._depth_total += depth
+        self._depth_count += 1
+        if depth > self._depth_max:
+            self._depth_max = depth
+
+    def on_lock_wait(self, seconds):
+        self.stages[STAGE_LOCK].record(int(seconds * 1000000))
+
+    def export(self):
+        latency = {stage: histogram.export() for stage, histogram in self.stages.items()}
+        latency[KEY_QUEUE_DEPTH] = {
+            KEY_DEPTH_LAST: self._depth_last,
+            KEY_MAX: self._depth_max,
+            KEY_MEAN: round(self._depth_total / self._depth_count, 3) if self._depth_count else None,
+        }
+        return latency
+
+class LatencyLock():
+    """
+    A book lock that, while latency is sampled, records how long the book's
+    worker waits to acquire it. Other threads (readers) are not timed.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Set by the book while sampling.
+        self.latency = None
+        self.worker = None
+
+    def acquire(self, blocking=True, timeout=-1):
+        return self._lock.acquire(blocking, timeout)
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        latency = self.latency
+        if latency is None or threading.get_ident() != self.worker:
+            self._lock.acquire()
+            return self
+        start = time.perf_counter()
+        self._lock.acquire()
+        latency.on_lock_wait(time.perf_counter() - start)
+        return self
+
+    def __exit__(self, *args):
+        self._lock.release()
+
+def iso_to_unix(iso_time):
+    """Convert an exchange ISO time with a trailing Z (ie. Cbpro 'time') to unix seconds, or None."""
+    if not iso_time:
+        return None
+    return dt.datetime.fromisoformat(iso_time[:-1]).replace(tzinfo=dt.timezone.utc).timestamp()
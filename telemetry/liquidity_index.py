@@ -0,0 +1,244 @@
+from array import array
+from decimal import Decimal
+
+"""
+Liquidity Index: Logarithmic time liquidity queries over an L2 order book.
+
+Each side of the book is mirrored onto a fixed ladder of equal width price
+slots centered on the mid price, with Fenwick trees holding the cumulative
+size and notional per slot. Slots are ordered away from the touch (ascending
+for asks, descending for bids), so a prefix sum is the liquidity from the
+touch out to a slot. Queries find the slot where the answer lies in O(log n)
+and then walk only the levels within that one slot.
+
+Sums are floats, so results are approximate to float precision. The ladder
+is rebuilt from the book when the mid price drifts too far from its center,
+and after every REBUILD_UPDATES level changes so rounding error from the
+incremental updates cannot accumulate. Levels outside the ladder are not
+indexed.
+"""
+
+# The ladder covers the mid price +/- 25%. It is rebuilt once the mid moves
+# more than 5% from the center, so depth within 10% of the touch is always covered.
+LADDER_RANGE = 0.25
+REBUILD_DRIFT = 0.05
+# Rebuilds run under the book's lock, so the ladder is kept small enough to
+# rebuild in a few milliseconds. Slots are ~0.012% of the mid wide, which
+# leaves only a few levels to walk per query.
+LADDER_SLOTS = 1 << 12
+REBUILD_UPDATES = 100000
+
+class FenwickTree():
+    """Prefix sums over n slots with O(log n) point updates and searches."""
+    def __init__(self, n, values=None):
+        self._n = n
+        self._tree = array('d', bytes(8 * (n+1)))
+        self._step = 1 << (n.bit_length() - 1)
+        if values:
+            # Linear time construction.
+            tree = self._tree
+            for i, value in enumerate(values, 1):
+                tree[i] += value
+                parent = i + (i & -i)
+                if parent <= n:
+                    tree[parent] += tree[i]
+
+    def add(self, i, delta):
+        tree = self._tree
+        i += 1
+        while i <= self._n:
+            tree[i] += delta
+            i += i & -i
+
+    def prefix(self, i):
+        """Sum of slots [0, i)."""
+        tree = self._tree
+        total = 0.0
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def search(self, target):
+        """Return (i, prefix(i)) for the first slot i at which the running sum reaches target.
+
+        i is n if the total of all slots is below target.
+        """
+        tree = self._tree
+        pos = 0
+        remaining = target
+        step = self._step
+        while step:
+            if pos + step <= self._n and tree[pos + step] < remaining:
+                pos += step
+                remaining -= tree[pos]
+            step >>= 1
+        return pos, target - remaining
+
+class LiquidityIndex():
+    """
+    Liquidity Index over the bids and asks SortedDicts of an L2 order book.
+
+    Not thread safe; callers hold the owning book's lock. Sides are 'buy' or
+    'sell' for taker queries (a buy fills against the asks) and 'bid' or 'ask'
+    for depth. Results are floats, or None if the book is empty or the ladder
+    does not hold enough liquidity to answer.
+    """
+    def __init__(self, bids, asks, slots=LADDER_SLOTS):
+        self._bids = bids
+        self._asks = asks
+        self._slots = slots
+        self._center = None
+        self._updates = 0
+
+    def nbytes(self):
+        # Size and notional trees for both sides, once built.
+        return 0 if self._center is None else 4 * 8 * (self._slots + 1)
+
+    def invalidate(self):
+        # Called when the book is replaced wholesale, ie. on a snapshot.
+        self._center = None
+
+    def _ask_slot(self, price):
+        return int((float(price) - self._lo) // self._width)
+
+    def _slot(self, is_bid, price):
+        # Bid slots run the other way so that slot 0 is always nearest the touch.
+        slot = self._ask_slot(price)
+        return self._slots - 1 - slot if is_bid else slot
+
+    def rebuild(self):
+        mid = (float(self._bids.peekitem(-1)[0]) + float(self._asks.peekitem(0)[0])) / 2
+        self._center = mid
+        self._lo = mid * (1 - LADDER_RANGE)
+        self._width = 2 * LADDER_RANGE * mid / self._slots
+        self._updates = 0
+
+        self._size = {}
+        self._notional = {}
+        lo, width, slots = self._lo, self._width, self._slots
+        for is_bid, levels in ((True, self._bids), (False, self._asks)):
+            sizes = array('d', bytes(8 * slots))
+            notionals = array('d', bytes(8 * slots))
+            # Slice the levels in range rather than look each one up, and
+            # inline _slot(), as this loop is most of the rebuild.
+            start = levels.bisect_left(Decimal(lo))
+            end = levels.bisect_right(Decimal(lo + slots * width))
+            for price, size in levels.items()[start:end]:
+                price = float(price)
+                slot = int((price - lo) // width)
+                if is_bid:
+                    slot = slots - 1 - slot
+                if 0 <= slot < slots:
+                    size = float(size)
+                    sizes[slot] += size
+                    notionals[slot] += size * price
+            self._size[is_bid] = FenwickTree(self._slots, sizes)
+            self._notional[is_bid] = FenwickTree(self._slots, notionals)
+
+    def refresh(self):
+        """Rebuild the ladder if needed. Returns False if the book is empty."""
+        if not self._bids or not self._asks:
+            return False
+        if self._center is not None and self._updates < REBUILD_UPDATES:
+            mid = (float(self._bids.peekitem(-1)[0]) + float(self._asks.peekitem(0)[0])) / 2
+            if abs(mid - self._center) <= REBUILD_DRIFT * self._center:
+                return True
+        self.rebuild()
+        return True
+
+    def on_level(self, is_bid, price, old_size, new_size):
+        if self._center is None:
+            return
+        slot = self._slot(is_bid, price)
+        if 0 <= slot < self._slots:
+            delta = float(new_size - old_size)
+            self._size[is_bid].add(slot, delta)
+            self._notional[is_bid].add(slot, delta * float(price))
+            self._updates += 1
+
+    def _walk(self, is_bid, slot):
+        # Levels within one slot in fill order, as floats.
+        ask_slot = self._slots - 1 - slot if is_bid else slot
+        if is_bid:
+            prices = self._bids.irange(maximum=Decimal(self._lo + (ask_slot+2) * self._width), reverse=True)
+        else:
+            prices = self._asks.irange(minimum=Decimal(self._lo + (ask_slot-1) * self._width))
+        levels = self._bids if is_bid else self._asks
+        for price in prices:
+            current = self._slot(is_bid, price)
+            if current < slot:
+                continue
+            if current > slot:
+                break
+            yield float(price), float(levels[price])
+
+    def cost_to_fill(self, side, notional):
+        """Fill a market order of notional (quote currency) against the book.
+
+        Returns (size, average price, worst price).
+        """
+        if not self.refresh():
+            return None
+        is_bid = side == 'sell'
+        slot, before = self._notional[is_bid].search(notional)
+        if slot >= self._slots:
+            return None
+        size = self._size[is_bid].prefix(slot)
+        remaining = notional - before
+        worst = None
+        for price, level_size in self._walk(is_bid, slot):
+            worst = price
+            if price * level_size >= remaining:
+                size += remaining / price
+                break
+            remaining -= price * level_size
+            size += level_size
+        if worst is None:
+            return None
+        return (size, notional / size, worst)
+
+    def price_for_size(self, side, size):
+        """Return the worst price reached by a market order of size (base currency)."""
+        if not self.refresh():
+            return None
+        is_bid = side == 'sell'
+        slot, before = self._size[is_bid].search(size)
+        if slot >= self._slots:
+            return None
+        remaining = size - before
+        worst = None
+        for price, level_size in self._walk(is_bid, slot):
+            worst = price
+            if level_size >= remaining:
+                break
+            remaining -= level_size
+        return worst
+
+    def depth_within(self, side, pct):
+        """Return the total size on side ('bid' or 'ask') within pct (ie. 0.01) of the touch.
+
+        Bounds beyond the ladder are answered by walking the book, in O(levels).
+        """
+        if not self.refresh():
+            return None
+        is_bid = side == 'bid'
+        if is_bid:
+            bound = float(self._bids.peekitem(-1)[0]) * (1 - pct)
+        else:
+            bound = float(self._asks.peekitem(0)[0]) * (1 + pct)
+        slot = self._slot(is_bid, bound)
+        if slot >= self._slots:
+            # The bound is off the ladder, sum the levels themselves.
+            if is_bid:
+                prices = self._bids.irange(minimum=Decimal(bound))
+            else:
+                prices = self._asks.irange(maximum=Decimal(bound))
+            levels = self._bids if is_bid else self._asks
+            return sum(float(levels[price]) for price in prices)
+        total = self._size[is_bid].prefix(slot)
+        for price, level_size in self._walk(is_bid, slot):
+            if (price < bound) if is_bid else (price > bound):
+                break
+            total += level_size
+        return total
@@ -0,0 +1,140 @@
+import os
+import mmap
+import time
+import struct
+import tempfile
+import json
+
+"""
+Shared Book: Latest order book records published in shared memory.
+
+The telemetry process publishes each book's latest export record into its own
+named segment, so any local process (ie. a strategy) can read it in
+microseconds without polling Mongo or the REST API. Segments are files under
+/dev/shm (a memory backed filesystem) mapped with mmap:
+
+    header:  magic 'SHBK', version, sequence (u64), payload length (u32)
+    payload: the record as UTF-8 JSON
+
+The sequence is a seqlock: the writer makes it odd before changing the
+payload and even again after, so a reader that sees the same even sequence
+before and after copying the payload has a consistent record. Readers never
+block the writer, they retry instead.
+
+Only this module is needed to read, it has no dependencies outside the
+standard library.
+
+Example:
+    reader = SharedBookReader('cb', 'SOL')
+    record = reader.read()
+    print(record['b'], record['a'])
+"""
+
+SEGMENT_MAGIC = b'SHBK'
+SEGMENT_VERSION = 1
+SEGMENT_HEADER = struct.Struct('<4sHxxQI')
+SEQUENCE_OFFSET = 8
+SEQUENCE = struct.Struct('<Q')
+
+# Pages are only allocated as they are written, so a generous capacity costs
+# nothing for small records.
+SEGMENT_SIZE = 1024*1024
+
+SHARED_MEMORY_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+# Reads retry while a write is in progress, for at most this long. A write
+# takes microseconds unless the writer is preempted mid-write.
+READ_TIMEOUT = 1.0 # seconds
+
+def segment_path(exchange, pair, root=SHARED_MEMORY_DIR):
+    return os.path.join(root, f"sniper-{exchange}-{pair}")
+
+class SharedBookWriter():
+    """
+    The Shared Book Writer publishes records of one exchange/pair. There must
+    be only one writer per segment.
+    """
+    def __init__(self, exchange, pair, root=SHARED_MEMORY_DIR):
+        self._path = segment_path(exchange, pair, root)
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, SEGMENT_SIZE)
+            self._mm = mmap.mmap(fd, SEGMENT_SIZE)
+        finally:
+            os.close(fd)
+        # Carry on from any previous segment, so its readers keep seeing the
+        # last record and the sequence never goes backwards.
+        magic, version, sequence, _ = SEGMENT_HEADER.unpack_from(self._mm)
+        if magic == SEGMENT_MAGIC and version == SEGMENT_VERSION and not sequence & 1:
+            self._sequence = sequence
+        else:
+            self._sequence = 0
+            SEGMENT_HEADER.pack_into(self._mm, 0, SEGMENT_MAGIC, SEGMENT_VERSION, 0, 0)
+
+    def publish(self, record):
+        """Publish a record (anything simplejson can serialize, ie. with Decimals)."""
+        payload = _dumps(record).encode('utf-8')
+        if SEGMENT_HEADER.size + len(payload) > SEGMENT_SIZE:
+            print(f"WARNING: Record of {len(payload)} bytes does not fit shared segment {self._path}")
+            return
+        mm = self._mm
+        SEQUENCE.pack_into(mm, SEQUENCE_OFFSET, self._sequence + 1)
+        mm[SEGMENT_HEADER.size:SEGMENT_HEADER.size + len(payload)] = payload
+        struct.pack_into('<I', mm, SEQUENCE_OFFSET + SEQUENCE.size, len(payload))
+        self._sequence += 2
+        SEQUENCE.pack_into(mm, SEQUENCE_OFFSET, self._sequence)
+
+    def close(self):
+        self._mm.close()
+
+class SharedBookReader():
+    """
+    The Shared Book Reader reads the latest record of one exchange/pair.
+    Prices and sizes are read as floats.
+    """
+    def __init__(self, exchange, pair, root=SHARED_MEMORY_DIR):
+        self._path = segment_path(exchange, pair, root)
+        with open(self._path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, _ = SEGMENT_HEADER.unpack_from(self._mm)
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f"{self._path} is not a shared book segment")
+        if version != SEGMENT_VERSION:
+            raise ValueError(f"{self._path} has unsupported version {version}")
+
+    @property
+    def sequence(self):
+        """Sequence of the latest record, cheap to poll for changes. Increases by 2 per record."""
+        return SEQUENCE.unpack_from(self._mm, SEQUENCE_OFFSET)[0]
+
+    def read_raw(self):
+        """Return (sequence, payload bytes) of the latest record, or None if nothing is published yet."""
+        mm = self._mm
+        deadline = None
+        while True:
+            _, _, before, length = SEGMENT_HEADER.unpack_from(mm)
+            if not before & 1:
+                payload = mm[SEGMENT_HEADER.size:SEGMENT_HEADER.size + length]
+                if SEQUENCE.unpack_from(mm, SEQUENCE_OFFSET)[0] == before:
+                    return (before, payload) if before else None
+            # A write is in progress. Yield so a preempted writer can finish
+            # (on a single core it cannot otherwise), then try again.
+            os.sched_yield()
+            if deadline is None:
+                deadline = time.monotonic() + READ_TIMEOUT
+            elif time.monotonic() > deadline:
+                raise TimeoutError(f"Timed out reading {self._path}, is its writer stuck?")
+
+    def read(self):
+        """Return the latest record as a dict, or None if nothing is published yet."""
+        raw = self.read_raw()
+        return None if raw is None else json.loads(raw[1])
+
+    def close(self):
+        self._mm.close()
+
+def _dumps(record):
+    # Only the writer needs simplejson, which writes the Decimals in export
+    # records as JSON numbers like the telemetry documents.
+    import simplejson
+    return simplejson.dumps(record)
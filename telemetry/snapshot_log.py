@@ -0,0 +1,172 @@
+import os
+import mmap
+import struct
+import datetime as dt
+import numpy as np
+
+from telemetry_db import EPOCH
+
+"""
+Snapshot Log: Append-only binary log of telemetry samples.
+
+Every sample for one exchange/pair is appended as a fixed-width little endian
+record to a file that rotates daily:
+
+    <root>/<exchange>-<pair>-<YYYYMMDD>.snpl
+
+Each file starts with a 64 byte header describing the record layout:
+
+    magic       4s   b'SNPL'
+    version     H
+    header size H
+    record size I
+    bid bins    H
+    ask bins    H
+    exchange    8s
+    pair        16s
+
+followed by records of:
+
+    t   int64           sample time (UTC microseconds since epoch)
+    b   float64         best bid
+    a   float64         best ask
+    bd  float64[bids]   bid bin depth (B9..B0)
+    ad  float64[asks]   ask bin depth (A0..A9)
+    u   int64           order book last update time (UTC microseconds since epoch)
+
+Records are sorted by time, so readers can mmap a file and binary search it
+without parsing anything. The log is written independently of Mongo and keeps
+recording while the database is unavailable.
+"""
+
+MAGIC = b'SNPL'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHHIHH8s16s')
+HEADER_SIZE = 64
+FILE_EXTENSION = '.snpl'
+
+def to_epoch_us(t):
+    """Convert a naive UTC datetime, Coinbase ISO string or Binance ms timestamp to epoch microseconds."""
+    if t is None:
+        return 0
+    if isinstance(t, str):
+        t = dt.datetime.fromisoformat(t.rstrip('Z'))
+    if isinstance(t, dt.datetime):
+        return (t - EPOCH) // dt.timedelta(microseconds=1)
+    return int(t) * 1000
+
+def record_dtype(bid_bins, ask_bins):
+    return np.dtype([('t', '<i8'), ('b', '<f8'), ('a', '<f8'),
+                     ('bd', '<f8', (bid_bins,)), ('ad', '<f8', (ask_bins,)),
+                     ('u', '<i8')])
+
+class SnapshotLogWriter():
+    def __init__(self, root, exchange, pair, bid_labels, ask_labels):
+        self._root = root
+        self._exchange = exchange
+        self._pair = pair
+        self._bid_labels = bid_labels
+        self._ask_labels = ask_labels
+        self._record = struct.Struct(f"<qdd{len(bid_labels)}d{len(ask_labels)}dq")
+        self._header = HEADER.pack(MAGIC, FORMAT_VERSION, HEADER_SIZE, self._record.size,
+                                   len(bid_labels), len(ask_labels),
+                                   exchange.encode(), pair.encode()).ljust(HEADER_SIZE, b'\0')
+        self._file = None
+        self._day = None
+
+        os.makedirs(root, exist_ok=True)
+
+    @property
+    def path(self):
+        return self._file.name if self._file else None
+
+    def _open(self, day):
+        self.close()
+        base = os.path.join(self._root, f"{self._exchange}-{self._pair}-{day:%Y%m%d}")
+        path = base + FILE_EXTENSION
+        suffix = 0
+        while os.path.exists(path):
+            with open(path, 'rb') as f:
+                header = f.read(HEADER_SIZE)
+            if header == self._header:
+                break
+            # Layout changed since the file was started, don't mix record sizes.
+            suffix += 1
+            path = f"{base}.{suffix}{FILE_EXTENSION}"
+
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(self._header)
+        else:
+            # Drop any partial record left behind by a crash mid-write.
+            records = (self._file.tell() - HEADER_SIZE) // self._record.size
+            self._file.truncate(HEADER_SIZE + records*self._record.size)
+            self._file.seek(0, os.SEEK_END)
+        self._day = day
+
+    def append(self, timestamp, record):
+        day = timestamp.date()
+        if day != self._day:
+            self._open(day)
+
+        bid_depth = record['bd']['size']
+        ask_depth = record['ad']['size']
+        self._file.write(self._record.pack(
+            to_epoch_us(timestamp), record['b'], record['a'],
+            *[bid_depth.get(label) or 0.0 for label in self._bid_labels],
+            *[ask_depth.get(label) or 0.0 for label in self._ask_labels],
+            to_epoch_us(record['u'])))
+        self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+            self._day = None
+
+class SnapshotLogReader():
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        magic, version, header_size, record_size, bid_bins, ask_bins, exchange, pair = HEADER.unpack(self._file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"Not a snapshot log: {path}")
+        self._header_size = header_size
+        self._dtype = record_dtype(bid_bins, ask_bins)
+        if self._dtype.itemsize != record_size:
+            raise ValueError(f"Unexpected record size {record_size} (expected {self._dtype.itemsize}): {path}")
+        self.exchange = exchange.rstrip(b'\0').decode()
+        self.pair = pair.rstrip(b'\0').decode()
+        self._mmap = None
+        self.records = None
+        self.refresh()
+
+    def refresh(self):
+        """Re-map the file to pick up records appended since it was opened."""
+        size = os.fstat(self._file.fileno()).st_size
+        count = (size - self._header_size) // self._dtype.itemsize
+        if count <= 0:
+            self.records = np.empty(0, dtype=self._dtype)
+            return
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.records = np.frombuffer(self._mmap, dtype=self._dtype, count=count, offset=self._header_size)
+
+    def __len__(self):
+        return len(self.records)
+
+    def find(self, timestamp):
+        """Return the latest record at or before timestamp, or None."""
+        i = np.searchsorted(self.records['t'], to_epoch_us(timestamp), side='right')
+        return self.records[i-1] if i > 0 else None
+
+    def between(self, start, end):
+        """Return a view of the records in [start, end)."""
+        t = self.records['t']
+        lo = np.searchsorted(t, to_epoch_us(start), side='left')
+        hi = np.searchsorted(t, to_epoch_us(end), side='left')
+        return self.records[lo:hi]
+
+    def close(self):
+        # The map is released once the last view into it is garbage collected.
+        self.records = None
+        self._mmap = None
+        self._file.close()
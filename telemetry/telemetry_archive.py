@@ -0,0 +1,149 @@
+import os
+import json
+import datetime as dt
+import click
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+from pymongo import ASCENDING
+
+from telemetry_db import (get_collection, KEY_TIMESTAMP, parse_books, DEFAULT_BOOK_CONFIG, WRITER_LAG)
+from telemetry_loader import (load_telemetry, DEFAULT_FIELDS, MATRIX_FIELDS)
+
+"""
+Telemetry Archive: Columnar history of the telemetry collection.
+
+Telemetry is exported to Parquet files partitioned by exchange, pair and day:
+
+    <root>/exchange=cb/pair=SOL/date=2021-12-19/part-000000-235959.parquet
+
+Exports are incremental. A watermark per exchange/pair records the end of the
+last exported time range, so each run only exports what was written since.
+Readers filter on the partition keys and timestamp and memory-map the files,
+so backtests and research never have to query the live database.
+"""
+
+ARCHIVE_COMPRESSION = 'zstd'
+WATERMARK_FILE = '_watermark.json'
+WATERMARK_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+PARTITIONING = ds.partitioning(pa.schema([('exchange', pa.string()),
+                                          ('pair', pa.string()),
+                                          ('date', pa.string())]), flavor='hive')
+
+def _read_watermarks(root):
+    path = os.path.join(root, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return {key: dt.datetime.strptime(value, WATERMARK_FORMAT) for key, value in json.load(f).items()}
+
+def _write_watermarks(root, watermarks):
+    # Write then rename so a crash mid-write never corrupts the watermarks.
+    path = os.path.join(root, WATERMARK_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({key: value.strftime(WATERMARK_FORMAT) for key, value in watermarks.items()}, f, indent=4)
+    os.replace(path + '.tmp', path)
+
+def _to_table(data):
+    # Depth matrices are flattened into one column per bin label.
+    columns = {}
+    for field, array in data.items():
+        if field in MATRIX_FIELDS:
+            for i, label in enumerate(MATRIX_FIELDS[field]):
+                columns[label] = array[:, i]
+        else:
+            columns[field] = array
+    return pa.table(columns)
+
+def _from_table(table, fields):
+    data = {}
+    for field in fields:
+        if field in MATRIX_FIELDS:
+            data[field] = np.column_stack([table.column(label).to_numpy() for label in MATRIX_FIELDS[field]])
+        else:
+            data[field] = table.column(field).to_numpy()
+    return data
+
+def _next_midnight(t):
+    return dt.datetime.combine(t.date() + dt.timedelta(days=1), dt.time())
+
+def export_archive(root, books, end=None, start=None, collection=None):
+    """Export new telemetry for each (exchange, pair) in books up to end.
+
+    Exports resume from each book's watermark. Books without a watermark start
+    from the given start time, or the oldest document in the collection.
+    """
+    if collection is None:
+        collection = get_collection()
+    if end is None:
+        end = (dt.datetime.utcnow() - WRITER_LAG).replace(microsecond=0)
+
+    os.makedirs(root, exist_ok=True)
+    watermarks = _read_watermarks(root)
+
+    for exchange, pair in books:
+        key = f"{exchange}.{pair}"
+        lo = watermarks.get(key, start)
+        if lo is None:
+            first = collection.find_one({key: {'$exists': True}}, projection={KEY_TIMESTAMP: 1}, sort=[(KEY_TIMESTAMP, ASCENDING)])
+            if first is None:
+                continue
+            lo = first[KEY_TIMESTAMP]
+
+        # Export one day partition at a time so memory stays bounded.
+        while lo < end:
+            hi = min(_next_midnight(lo), end)
+            data = load_telemetry(exchange, pair, lo, hi, fields=DEFAULT_FIELDS, collection=collection)
+            if len(data[KEY_TIMESTAMP]):
+                directory = os.path.join(root, f"exchange={exchange}", f"pair={pair}", f"date={lo:%Y-%m-%d}")
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, f"part-{lo:%H%M%S}-{hi - dt.timedelta(microseconds=1):%H%M%S}.parquet")
+                pq.write_table(_to_table(data), path, compression=ARCHIVE_COMPRESSION)
+                print(f"Exported {len(data[KEY_TIMESTAMP])} samples to {path}")
+
+            lo = hi
+            watermarks[key] = lo
+            _write_watermarks(root, watermarks)
+
+    return watermarks
+
+def read_archive(root, exchange, pair, start, end, fields=DEFAULT_FIELDS):
+    """Read archived telemetry for one exchange/pair between two UTC datetimes [start, end).
+
+    Returns the same dict of NumPy arrays as load_telemetry(). Only the day
+    partitions overlapping the range are opened, and files are memory-mapped.
+    """
+    fields = list(fields)
+    if KEY_TIMESTAMP not in fields:
+        fields.insert(0, KEY_TIMESTAMP)
+
+    columns = []
+    for field in fields:
+        columns += list(MATRIX_FIELDS[field]) if field in MATRIX_FIELDS else [field]
+
+    dataset = ds.dataset(root, format='parquet', partitioning=PARTITIONING,
+                         filesystem=fs.LocalFileSystem(use_mmap=True))
+    t = ds.field(KEY_TIMESTAMP)
+    date = ds.field('date')
+    predicate = ((ds.field('exchange') == exchange) & (ds.field('pair') == pair) &
+                 (date >= f"{start:%Y-%m-%d}") & (date <= f"{end:%Y-%m-%d}") &
+                 (t >= pa.scalar(start, type=pa.timestamp('us'))) &
+                 (t < pa.scalar(end, type=pa.timestamp('us'))))
+    table = dataset.to_table(columns=columns, filter=predicate).sort_by(KEY_TIMESTAMP)
+    return _from_table(table, fields)
+
+@click.command()
+@click.option('--root', default='archive', help='Archive root directory')
+@click.option('--config', default=DEFAULT_BOOK_CONFIG, help='Order book registry config file')
+@click.option('--book', 'books', multiple=True,
+              help='Exchange and pair to export as <exchange>:<pair> (ie. cb:SOL). May be repeated. Defaults to every book in the config.')
+def export(root, config, books):
+    """Incrementally export telemetry to the Parquet archive."""
+    books = parse_books(books, config)
+    export_archive(root, books)
+
+if __name__ == '__main__':
+    export()
@@ -0,0 +1,147 @@
+import os
+import json
+import datetime as dt
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+"""
+Telemetry DB: Document schema keys and collection provisioning shared by the
+telemetry writer (global_order_book.py) and any readers of the collection.
+"""
+
+DEFAULT_MONGO_URL = 'mongodb://localhost:27017/'
+DEFAULT_DB = 'sniper-db'
+DEFAULT_COLLECTION = 'telemetry'
+
+KEY_METADATA = 'm'
+KEY_VERSION = 'v'
+KEY_SESSION_ID = 's'
+KEY_SAMPLE_MODE = 'md'
+KEY_META_EXCHANGE = 'e'
+KEY_META_PAIR = 'p'
+
+KEY_TIMESTAMP = 't'
+KEY_INTENDED_TIMESTAMP = 'ti'
+KEY_CAPTURE_SPREAD = 'cs'
+
+KEY_EXCHANGE_COINBASE = 'cb'
+KEY_EXCHANGE_BINANCE = 'bi'
+KEY_EXCHANGE_BINANCEUS = 'bu'
+
+# The base currency is used to identify the trading pair. The quote
+# currency can always be assumed to be USD or equivalent (ie. USDT)
+# if it is missing from the pair.
+KEY_TRADING_PAIR_BTC_USD = 'BTC'
+KEY_TRADING_PAIR_ETH_USD = 'ETH'
+KEY_TRADING_PAIR_SOL_USD = 'SOL'
+KEY_TRADING_PAIR_MATIC_USD = 'MATIC'
+
+KEY_LAST_UPDATE_AT = 'u'
+KEY_BID = 'b'
+KEY_ASK = 'a'
+KEY_BID_DEPTH = 'bd'
+KEY_ASK_DEPTH = 'ad'
+KEY_EXPORT_TIME = 'xt'
+KEY_INTERVAL_STATS = 'is' # See book_stats.py for the keys within
+KEY_FEATURES = 'f' # See book_features.py for the keys within
+KEY_MEMORY = 'mu' # See memory_usage() in base_level2_order_book.py for the keys within
+KEY_BIN_SETS = 'bs' # Configured extra bin sets by name, each with its own 'bd' and 'ad'
+KEY_TRADE_FLOW = 'tf' # See trade_stats.py for the keys within
+
+# Rollup (downsampled) documents mirror the raw layout. 'b', 'a', 'bd' and 'ad'
+# hold the last sample of the interval, alongside these aggregates:
+KEY_ROLLUP_INTERVAL = 'i'
+KEY_SAMPLE_COUNT = 'n'
+KEY_MID_OPEN = 'o'
+KEY_MID_HIGH = 'h'
+KEY_MID_LOW = 'l'
+KEY_MID_CLOSE = 'c'
+KEY_SPREAD_MEAN = 'sm'
+KEY_SPREAD_LAST = 'sl'
+KEY_BID_DEPTH_MEAN = 'bdm'
+KEY_ASK_DEPTH_MEAN = 'adm'
+
+ROLLUP_COLLECTIONS = {
+    '1m': DEFAULT_COLLECTION + '_1m',
+    '1h': DEFAULT_COLLECTION + '_1h',
+}
+ROLLUP_STATE_COLLECTION = DEFAULT_COLLECTION + '_rollup_state'
+
+# The order book registry: every exchange/pair recorded by the global order book.
+DEFAULT_BOOK_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'books.json')
+
+# Telemetry is sampled at a configurable rate in interval mode (1Hz by
+# default, --rate), or per book in event mode as it changes, between every
+# 0.1s and 10s by default (see global_order_book.py). Samples are seconds
+# apart or less either way, which 'seconds' granularity (hour long
+# time-series buckets) suits.
+TIMESERIES_GRANULARITY = 'seconds'
+
+# Batch readers of the live collection (archive, rollups) stay this far
+# behind the writer so samples still in flight are not skipped.
+WRITER_LAG = dt.timedelta(seconds=10)
+
+EPOCH = dt.datetime(1970, 1, 1)
+
+def read_book_config(path=DEFAULT_BOOK_CONFIG):
+    """Read the order book registry config.
+
+    The config is a JSON list with one entry per order book:
+      - exchange: exchange key in the telemetry document (ie. 'cb')
+      - pair: trading pair key in the telemetry document (ie. 'SOL')
+      - book: order book class name (ie. 'Cb_L2OrderBook' for depth, or
+        'Cb_TickerBook' for the top of book only)
+      - symbol: exchange product id / symbol (ie. 'SOL-USD')
+      - options: (optional) extra order book constructor arguments
+      - trades: (optional) trade flow to record with the book, as its class
+        name under 'flow' and any extra constructor arguments
+    """
+    with open(path) as f:
+        return json.load(f)
+
+def parse_books(books, config=DEFAULT_BOOK_CONFIG):
+    """Return [(exchange, pair)] for 'exchange:pair' arguments, or for every book in the config if there are none."""
+    return [tuple(book.split(':')) for book in books] or [(entry['exchange'], entry['pair']) for entry in read_book_config(config)]
+
+def get_collection(url=DEFAULT_MONGO_URL, db=DEFAULT_DB, collection=DEFAULT_COLLECTION):
+    mongo_client = MongoClient(url)
+    return mongo_client[db][collection]
+
+def create_telemetry_collection(db, name=DEFAULT_COLLECTION):
+    """Provision the telemetry collection and its indexes.
+
+    On MongoDB 5.0+ the collection is created as a time-series collection with
+    the timestamp as time field and the document metadata (version, session)
+    as meta field. Older servers fall back to a regular collection. Either way
+    the collection is indexed on the timestamp so that latest-document and
+    time-range reads never scan the collection. Safe to call on every startup.
+    """
+    if name not in db.list_collection_names():
+        try:
+            db.create_collection(name, timeseries={
+                'timeField': KEY_TIMESTAMP,
+                'metaField': KEY_METADATA,
+                'granularity': TIMESERIES_GRANULARITY})
+            print(f"Created time-series collection: {name}")
+        except CollectionInvalid:
+            # Lost a race with another writer, the collection already exists.
+            pass
+        except OperationFailure as e:
+            # Server does not support time-series collections (< 5.0).
+            print(f"Time-series collection not supported ({e}), using regular collection: {name}")
+            db.create_collection(name)
+
+    collection = db[name]
+    collection.create_index([(KEY_TIMESTAMP, DESCENDING)])
+    collection.create_index([(f"{KEY_METADATA}.{KEY_SESSION_ID}", ASCENDING), (KEY_TIMESTAMP, DESCENDING)])
+    return collection
+
+def create_rollup_collection(db, name):
+    """Provision a rollup collection with one document per interval start time.
+
+    Rollups are upserted as each exchange/pair is processed, which time-series
+    collections do not support, so these are always regular collections.
+    """
+    collection = db[name]
+    collection.create_index([(KEY_TIMESTAMP, DESCENDING)], unique=True)
+    return collection
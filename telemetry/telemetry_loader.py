@@ -0,0 +1,127 @@
+import datetime as dt
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import ASCENDING
+
+from base_level2_order_book import L2OrderBook
+from telemetry_db import (get_collection, DEFAULT_COLLECTION, ROLLUP_COLLECTIONS,
+    KEY_TIMESTAMP, KEY_BID, KEY_ASK, KEY_BID_DEPTH, KEY_ASK_DEPTH, KEY_BID_DEPTH_MEAN, KEY_ASK_DEPTH_MEAN)
+
+"""
+Telemetry Loader: Bulk columnar reads of the telemetry collection.
+
+Documents are fetched with projections over several time-range partitioned
+cursors in parallel and decoded straight into preallocated NumPy arrays, so
+analysis never has to rebuild DataFrames from nested documents one at a time.
+"""
+
+DEFAULT_FIELDS = (KEY_TIMESTAMP, KEY_BID, KEY_ASK, KEY_BID_DEPTH, KEY_ASK_DEPTH)
+
+# Depth fields are decoded into (n, 10) matrices with columns ordered by label.
+# Bid columns run from the deepest bin (B9) to the touch (B0), matching the
+# order the bins are written in.
+MATRIX_FIELDS = {
+    KEY_BID_DEPTH: L2OrderBook.BID_LABELS,
+    KEY_ASK_DEPTH: L2OrderBook.ASK_LABELS,
+    KEY_BID_DEPTH_MEAN: L2OrderBook.BID_LABELS,
+    KEY_ASK_DEPTH_MEAN: L2OrderBook.ASK_LABELS,
+}
+
+BATCH_SIZE = 10000
+DEFAULT_PARTITIONS = 4
+
+def _split_range(start, end, partitions):
+    step = (end - start) / partitions
+    edges = [start + step*i for i in range(partitions)] + [end]
+    return list(zip(edges[:-1], edges[1:]))
+
+def _allocate(fields, n):
+    arrays = {}
+    for field in fields:
+        if field == KEY_TIMESTAMP:
+            arrays[field] = np.empty(n, dtype='datetime64[us]')
+        elif field in MATRIX_FIELDS:
+            arrays[field] = np.full((n, len(MATRIX_FIELDS[field])), np.nan)
+        else:
+            arrays[field] = np.full(n, np.nan)
+    return arrays
+
+def load_telemetry(exchange, pair, start, end, fields=DEFAULT_FIELDS, collection=None, partitions=DEFAULT_PARTITIONS, resolution=None):
+    """Load telemetry for one exchange/pair between two UTC datetimes [start, end).
+
+    Raw 1s samples are read by default. Pass resolution='1m' or '1h' to read the
+    rollups instead, which also provide 'o', 'h', 'l', 'c' (mid price), 'sm',
+    'sl' (mean/last spread), 'n' (sample count) and 'bdm', 'adm' (mean depth).
+
+    Returns a dict of NumPy arrays keyed by field, sorted by timestamp:
+      - 't': datetime64[us] timestamps
+      - 'b', 'a' (and any other scalar field): float64 arrays
+      - 'bd', 'ad' (and 'bdm', 'adm'): (n, 10) float64 bin matrices
+
+    Example:
+        data = load_telemetry('cb', 'SOL', dt.datetime(2021, 12, 19), dt.datetime(2021, 12, 20))
+        mid = (data['b'] + data['a']) / 2
+    """
+    if collection is None:
+        collection = get_collection(collection=ROLLUP_COLLECTIONS[resolution] if resolution else DEFAULT_COLLECTION)
+
+    fields = list(fields)
+    if KEY_TIMESTAMP not in fields:
+        fields.insert(0, KEY_TIMESTAMP)
+
+    prefix = f"{exchange}.{pair}"
+    projection = {'_id': 0, KEY_TIMESTAMP: 1}
+    for field in fields:
+        if field != KEY_TIMESTAMP:
+            projection[f"{prefix}.{field}"] = 1
+
+    def make_query(lo, hi):
+        return {KEY_TIMESTAMP: {'$gte': lo, '$lt': hi}, prefix: {'$exists': True}}
+
+    ranges = _split_range(start, end, max(1, partitions))
+
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        # Count first so that every partition decodes into its own slice of one
+        # preallocated set of arrays instead of growing lists.
+        counts = list(executor.map(lambda r: collection.count_documents(make_query(*r)), ranges))
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        arrays = _allocate(fields, int(offsets[-1]))
+
+        def fill(i):
+            row = int(offsets[i])
+            stop = int(offsets[i+1])
+            cursor = collection.find(make_query(*ranges[i]), projection=projection,
+                                     sort=[(KEY_TIMESTAMP, ASCENDING)], batch_size=BATCH_SIZE)
+            for document in cursor:
+                # Documents written after the count was taken are ignored.
+                if row >= stop:
+                    break
+                record = document[exchange][pair]
+                for field, array in arrays.items():
+                    if field == KEY_TIMESTAMP:
+                        array[row] = document[KEY_TIMESTAMP]
+                    elif field in MATRIX_FIELDS:
+                        sizes = record.get(field, {}).get('size', {})
+                        array[row] = [sizes.get(label, np.nan) for label in MATRIX_FIELDS[field]]
+                    else:
+                        value = record.get(field)
+                        if value is not None:
+                            array[row] = value
+                row += 1
+            return row - int(offsets[i])
+
+        filled = list(executor.map(fill, range(len(ranges))))
+
+    # Drop any rows left unfilled (ie. documents removed between count and fetch).
+    if filled != counts:
+        keep = np.concatenate([np.arange(offsets[i], offsets[i] + filled[i]) for i in range(len(ranges))]).astype(np.int64)
+        arrays = {field: array[keep] for field, array in arrays.items()}
+
+    return arrays
+
+if __name__ == '__main__':
+    end = dt.datetime.utcnow()
+    data = load_telemetry(exchange='cb', pair='SOL', start=end - dt.timedelta(hours=1), end=end)
+    print(f"Loaded {len(data[KEY_TIMESTAMP])} samples")
+    for field, array in data.items():
+        print(field, array.shape, array[-1] if len(array) else None)
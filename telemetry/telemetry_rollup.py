@@ -0,0 +1,144 @@
+import datetime as dt
+import click
+import numpy as np
+from pymongo import MongoClient, UpdateOne, ASCENDING
+
+from telemetry_db import (DEFAULT_MONGO_URL, DEFAULT_DB, DEFAULT_COLLECTION, parse_books, DEFAULT_BOOK_CONFIG, WRITER_LAG, EPOCH,
+    ROLLUP_COLLECTIONS, ROLLUP_STATE_COLLECTION, create_rollup_collection,
+    KEY_METADATA, KEY_ROLLUP_INTERVAL, KEY_TIMESTAMP, KEY_BID, KEY_ASK, KEY_BID_DEPTH, KEY_ASK_DEPTH,
+    KEY_SAMPLE_COUNT, KEY_MID_OPEN, KEY_MID_HIGH, KEY_MID_LOW, KEY_MID_CLOSE,
+    KEY_SPREAD_MEAN, KEY_SPREAD_LAST, KEY_BID_DEPTH_MEAN, KEY_ASK_DEPTH_MEAN)
+from telemetry_loader import (load_telemetry, DEFAULT_FIELDS, MATRIX_FIELDS)
+
+"""
+Telemetry Rollup: Incremental 1m and 1h aggregates of the 1s telemetry.
+
+For each interval and exchange/pair, the rollup computes OHLC of the mid price,
+mean and last spread, and mean and last bin depth, and upserts them into a
+per-resolution collection (ie. telemetry_1m) using the same document layout as
+the raw telemetry. A watermark per exchange/pair/resolution records the end of
+the last completed interval so each run only processes new samples. Rollups
+can be read back with load_telemetry(..., resolution='1m').
+"""
+
+ROLLUP_INTERVALS = {
+    '1m': dt.timedelta(minutes=1),
+    '1h': dt.timedelta(hours=1),
+}
+
+# Raw samples are loaded a day at a time. Both intervals divide a day evenly.
+ROLLUP_CHUNK = dt.timedelta(days=1)
+
+def _floor(t, interval):
+    return EPOCH + ((t - EPOCH) // interval) * interval
+
+def _depth(labels, values):
+    return {'size': dict(zip(labels, values.tolist()))}
+
+def aggregate(data, start, interval):
+    """Aggregate loaded samples into intervals aligned to start.
+
+    Returns a list of (interval start time, record) tuples, one per interval
+    that contains at least one sample.
+    """
+    t = data[KEY_TIMESTAMP]
+    if len(t) == 0:
+        return []
+
+    # Samples are sorted, so each interval is a contiguous run of rows.
+    buckets = (t - np.datetime64(start, 'us')) // np.timedelta64(interval)
+    starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+    lasts = np.concatenate((starts[1:], [len(t)])) - 1
+    counts = lasts - starts + 1
+
+    mid = (data[KEY_BID] + data[KEY_ASK]) / 2
+    spread = data[KEY_ASK] - data[KEY_BID]
+    high = np.fmax.reduceat(mid, starts)
+    low = np.fmin.reduceat(mid, starts)
+    spread_mean = np.add.reduceat(spread, starts) / counts
+    bid_depth_mean = np.add.reduceat(data[KEY_BID_DEPTH], starts, axis=0) / counts[:, None]
+    ask_depth_mean = np.add.reduceat(data[KEY_ASK_DEPTH], starts, axis=0) / counts[:, None]
+
+    rollups = []
+    for i in range(len(starts)):
+        first = starts[i]
+        last = lasts[i]
+        rollups.append((start + int(buckets[first]) * interval, {
+            KEY_SAMPLE_COUNT: int(counts[i]),
+            KEY_MID_OPEN: float(mid[first]),
+            KEY_MID_HIGH: float(high[i]),
+            KEY_MID_LOW: float(low[i]),
+            KEY_MID_CLOSE: float(mid[last]),
+            KEY_SPREAD_MEAN: float(spread_mean[i]),
+            KEY_SPREAD_LAST: float(spread[last]),
+            KEY_BID: float(data[KEY_BID][last]),
+            KEY_ASK: float(data[KEY_ASK][last]),
+            KEY_BID_DEPTH: _depth(MATRIX_FIELDS[KEY_BID_DEPTH], data[KEY_BID_DEPTH][last]),
+            KEY_ASK_DEPTH: _depth(MATRIX_FIELDS[KEY_ASK_DEPTH], data[KEY_ASK_DEPTH][last]),
+            KEY_BID_DEPTH_MEAN: _depth(MATRIX_FIELDS[KEY_BID_DEPTH_MEAN], bid_depth_mean[i]),
+            KEY_ASK_DEPTH_MEAN: _depth(MATRIX_FIELDS[KEY_ASK_DEPTH_MEAN], ask_depth_mean[i]),
+        }))
+    return rollups
+
+def run_rollup(db, exchange, pair, resolution, end=None):
+    """Roll up new samples of one exchange/pair into the given resolution.
+
+    Only whole intervals are rolled up, from the stored watermark (or the
+    first recorded sample) to the last interval that ended before end.
+    Returns the number of interval documents written.
+    """
+    interval = ROLLUP_INTERVALS[resolution]
+    source = db[DEFAULT_COLLECTION]
+    target = create_rollup_collection(db, ROLLUP_COLLECTIONS[resolution])
+    state = db[ROLLUP_STATE_COLLECTION]
+
+    if end is None:
+        end = dt.datetime.utcnow() - WRITER_LAG
+    end = _floor(end, interval)
+
+    key = f"{exchange}.{pair}"
+    state_id = f"{key}.{resolution}"
+    watermark = state.find_one({'_id': state_id})
+    if watermark:
+        lo = watermark[KEY_TIMESTAMP]
+    else:
+        first = source.find_one({key: {'$exists': True}}, projection={KEY_TIMESTAMP: 1}, sort=[(KEY_TIMESTAMP, ASCENDING)])
+        if first is None:
+            return 0
+        lo = _floor(first[KEY_TIMESTAMP], interval)
+
+    written = 0
+    while lo < end:
+        hi = min(lo + ROLLUP_CHUNK, end)
+        data = load_telemetry(exchange, pair, lo, hi, fields=DEFAULT_FIELDS, collection=source)
+        requests = [UpdateOne({KEY_TIMESTAMP: t},
+                              {'$set': {key: record},
+                               '$setOnInsert': {KEY_METADATA: {KEY_ROLLUP_INTERVAL: resolution}}},
+                              upsert=True)
+                    for t, record in aggregate(data, lo, interval)]
+        if requests:
+            target.bulk_write(requests, ordered=False)
+            written += len(requests)
+
+        # Advance the watermark only once the chunk has been written.
+        lo = hi
+        state.update_one({'_id': state_id}, {'$set': {KEY_TIMESTAMP: lo}}, upsert=True)
+
+    return written
+
+@click.command()
+@click.option('--resolution', 'resolutions', multiple=True, default=list(ROLLUP_INTERVALS), help='Rollup resolution (1m or 1h). May be repeated.')
+@click.option('--config', default=DEFAULT_BOOK_CONFIG, help='Order book registry config file')
+@click.option('--book', 'books', multiple=True,
+              help='Exchange and pair to roll up as <exchange>:<pair> (ie. cb:SOL). May be repeated. Defaults to every book in the config.')
+def rollup(resolutions, config, books):
+    """Incrementally roll up telemetry into 1m and 1h aggregates."""
+    books = parse_books(books, config)
+    db = MongoClient(DEFAULT_MONGO_URL)[DEFAULT_DB]
+    for resolution in resolutions:
+        for exchange, pair in books:
+            written = run_rollup(db, exchange, pair, resolution)
+            print(f"Rolled up {written} {resolution} intervals for {exchange} {pair}")
+
+if __name__ == '__main__':
+    rollup()
@@ -0,0 +1,115 @@
+import threading
+import itertools
+from collections import deque
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import simplejson as json
+
+"""
+Telemetry Server: Latest and recent book records over local HTTP.
+
+The global order book keeps each exchange/pair's latest record and a bounded
+ring buffer of its recent records in memory, and serves them so readers on
+other hosts need neither Mongo access nor find().sort() queries against the
+telemetry collection. Records are serialized once, when they are added, and
+responses are assembled from those bytes, so any number of concurrent
+readers (one thread each) cost no more than copying bytes.
+
+Endpoints (JSON, records as in the telemetry documents plus their 't'):
+    GET /pairs                          [[exchange, pair], ...]
+    GET /latest/<exchange>/<pair>       the latest record
+    GET /recent/<exchange>/<pair>?n=60  the last n records, oldest first
+
+Example (global_order_book.py --serve-port 8765):
+    curl http://localhost:8765/latest/cb/SOL
+"""
+
+DEFAULT_HOST = '127.0.0.1'
+# Suggested port, serving is off unless a port is given.
+DEFAULT_PORT = 8765
+
+# Recent records kept per exchange/pair, 10 minutes at the default 1Hz.
+RECENT_RECORDS = 600
+
+class RecordCache():
+    """The latest and recent records of every exchange/pair. Safe to share between threads."""
+    def __init__(self, size=RECENT_RECORDS):
+        self._size = size
+        self._recent = {}
+        self._lock = threading.Lock()
+
+    def add(self, exchange, pair, record):
+        payload = json.dumps(record, separators=(',', ':')).encode('utf-8')
+        with self._lock:
+            key = (exchange, pair)
+            if key not in self._recent:
+                self._recent[key] = deque(maxlen=self._size)
+            self._recent[key].append(payload)
+
+    def pairs(self):
+        with self._lock:
+            return list(self._recent)
+
+    def latest(self, exchange, pair):
+        """Return the latest record's JSON bytes, or None."""
+        with self._lock:
+            recent = self._recent.get((exchange, pair))
+            return recent[-1] if recent else None
+
+    def recent(self, exchange, pair, n=None):
+        """Return the JSON bytes of a list of the last n (default all) records, or None."""
+        with self._lock:
+            recent = self._recent.get((exchange, pair))
+            if recent is None:
+                return None
+            start = 0 if n is None else max(0, len(recent) - max(0, n))
+            records = list(itertools.islice(recent, start, None))
+        return b'[' + b','.join(records) + b']'
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep connections alive, so polling readers do not reconnect per request.
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        cache = self.server.cache
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        body = None
+        try:
+            if parts == ['pairs']:
+                body = json.dumps(cache.pairs()).encode('utf-8')
+            elif len(parts) == 3 and parts[0] == 'latest':
+                body = cache.latest(parts[1], parts[2])
+            elif len(parts) == 3 and parts[0] == 'recent':
+                n = parse_qs(url.query).get('n')
+                body = cache.recent(parts[1], parts[2], int(n[0]) if n else None)
+        except ValueError:
+            self._send(400, b'{"error":"bad request"}')
+            return
+        if body is None:
+            self._send(404, b'{"error":"not found"}')
+        else:
+            self._send(200, body)
+
+    def log_message(self, format, *args):
+        # Requests are not logged, the console shows the sample count.
+        pass
+
+class TelemetryServer(ThreadingHTTPServer):
+    """Serves a RecordCache, with a thread per request."""
+    daemon_threads = True
+
+    def __init__(self, cache, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        super(TelemetryServer, self).__init__((host, port), _Handler)
+        self.cache = cache
+
+    def start(self):
+        """Serve from a background thread."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
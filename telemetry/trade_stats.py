@@ -0,0 +1,112 @@
+from collections import deque
+
+"""
+Trade Stats: Rolling window statistics over the trades (matches) of one pair.
+
+Each window keeps the trades received within its length in a deque, with
+running sums for notional, buy and sell volume and count, so recording a
+trade and expiring old ones are O(1) (amortized). The largest print is kept
+with a monotonic deque: sizes only ever decrease from front to back, so the
+window maximum is always at the front.
+"""
+
+DEFAULT_WINDOWS = {'1s': 1.0, '10s': 10.0, '1m': 60.0}
+
+KEY_LAST_PRICE = 'lp'
+KEY_TRADE_COUNT = 'n'
+KEY_VWAP = 'vw'
+KEY_BUY_VOLUME = 'bv'
+KEY_SELL_VOLUME = 'sv'
+KEY_LARGEST = 'mx'
+KEY_WINDOWS = 'w'
+
+class RollingWindow():
+    """
+    Rolling Window over the last length seconds of trades:
+      - trade count
+      - volume weighted average price
+      - taker buy and sell volume
+      - largest print (size)
+
+    Not thread safe; callers hold the owning trade flow's lock.
+    """
+    def __init__(self, length):
+        self.length = length
+        self._trades = deque()
+        self._largest = deque()
+        self._reset_sums()
+
+    def _reset_sums(self):
+        self._notional = 0.0
+        self._buy_volume = 0.0
+        self._sell_volume = 0.0
+
+    def add(self, now, price, size, is_buy):
+        self._expire(now)
+        self._trades.append((now, price * size, size, is_buy))
+        self._notional += price * size
+        if is_buy:
+            self._buy_volume += size
+        else:
+            self._sell_volume += size
+
+        largest = self._largest
+        while largest and largest[-1][1] <= size:
+            largest.pop()
+        largest.append((now, size))
+
+    def _expire(self, now):
+        cutoff = now - self.length
+        trades = self._trades
+        while trades and trades[0][0] <= cutoff:
+            _, notional, size, is_buy = trades.popleft()
+            self._notional -= notional
+            if is_buy:
+                self._buy_volume -= size
+            else:
+                self._sell_volume -= size
+        if not trades:
+            # Start the sums afresh so float error never accumulates.
+            self._reset_sums()
+
+        largest = self._largest
+        while largest and largest[0][0] <= cutoff:
+            largest.popleft()
+
+    def export(self, now):
+        self._expire(now)
+        volume = self._buy_volume + self._sell_volume
+        return {
+            KEY_TRADE_COUNT: len(self._trades),
+            KEY_VWAP: self._notional / volume if volume > 0 else None,
+            KEY_BUY_VOLUME: self._buy_volume,
+            KEY_SELL_VOLUME: self._sell_volume,
+            KEY_LARGEST: self._largest[0][1] if self._largest else None,
+        }
+
+class TradeFlowStats():
+    """
+    Trade Flow Stats hold one rolling window per configured length (ie. 1s,
+    10s and 1m) and the last traded price.
+
+    Not thread safe; callers hold the owning trade flow's lock.
+    """
+    def __init__(self, windows=None):
+        windows = DEFAULT_WINDOWS if windows is None else windows
+        self._windows = {label: RollingWindow(float(length)) for label, length in windows.items()}
+        self._last_price = None
+
+    def on_trade(self, now, price, size, is_buy):
+        self._last_price = price
+        for window in self._windows.values():
+            window.add(now, price, size, is_buy)
+
+    def on_last_price(self, price):
+        # Trades from before the feed started set the price only.
+        self._last_price = price
+
+    def export(self, now):
+        return {
+            KEY_LAST_PRICE: self._last_price,
+            KEY_WINDOWS: {label: window.export(now) for label, window in self._windows.items()},
+        }